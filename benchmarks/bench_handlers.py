@@ -0,0 +1,289 @@
+""" Offline load test of the slash command handlers
+
+    Runs the real handlers from fzdbot.bot (addScore, showScoreboard,
+    option_autocomplete, editScore, deleteScore) against fake
+    discord.Interaction objects and the embedded SQLite backend
+    (DB_BACKEND=sqlite), seeded with synthetic events. Replays end-of-event traffic bursts and
+    reports p50/p95/p99 latency and queries per command.
+
+    python -m benchmarks.bench_handlers                                  # run and print
+    python -m benchmarks.bench_handlers --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_handlers --compare benchmarks/baseline.json  # exit 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import discord
+
+
+# ----- fake discord objects -----
+
+class FakeUser:
+    def __init__(self, index: int):
+        self.id = 10_000 + index
+        self.name = f"player{index}"
+        self.nick = f"P{index:05d}" if index % 10 else None # Some players have no server nickname
+        self.display_name = f"Player {index}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        self._done = True
+        self._interaction.sent.append(content if embed is None else embed)
+        if view is not None:
+            self._interaction.handle_view(view)
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        self._interaction.sent.append(content if embed is None else embed)
+        return SimpleNamespace(content=content)
+
+
+class FakeInteraction:
+    """ Just enough of discord.Interaction for the handlers """
+    def __init__(self, user: FakeUser, **namespace):
+        self.user = user
+        self.guild_id = int(os.environ.get("SERVER_ID", 1))
+        self.type = discord.InteractionType.application_command
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.namespace = SimpleNamespace(**namespace)
+        self.sent = []
+
+    def handle_view(self, view) -> None:
+        if hasattr(view, "confirm_button"): # /delete_score confirmation, the user clicks "Yes"
+            click = FakeInteraction(self.user)
+            click.type = discord.InteractionType.component
+            asyncio.get_running_loop().create_task(view.confirm_button.callback(click))
+        else:
+            view.stop() # Scoreboard pager, nobody flips pages here
+
+    async def edit_original_response(self, content=None, *, embed=None, **kwargs):
+        self.sent.append(content if embed is None else embed)
+
+    async def delete_original_response(self):
+        pass
+
+
+# ----- measuring -----
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def timed(latencies: list, coro) -> None:
+    start = time.perf_counter()
+    await coro
+    latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def run_scenario(name: str, calls, concurrency: int, query_count) -> dict:
+    """ Runs the coroutine factories in `calls` with at most `concurrency` in flight,
+        returns latency percentiles (ms) and queries per command
+    """
+    latencies = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(make_call):
+        async with limit:
+            await timed(latencies, make_call())
+
+    queries_before = query_count()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(call) for call in calls))
+    elapsed = time.perf_counter() - start
+    queries = query_count() - queries_before
+
+    result = {
+        'calls': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries_per_command': round(queries / max(1, len(latencies)), 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    print(f"{name:<22} {result['calls']:>6} calls  p50 {result['p50_ms']:>8.2f} ms  "
+          f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+          f"{result['queries_per_command']:>6.2f} queries/cmd  {result['throughput_per_s']:>8.1f}/s")
+    return result
+
+
+# ----- traffic -----
+
+async def replay_end_of_event(handlers, args, query_count) -> dict:
+    rng = random.Random(args.seed)
+    players = [FakeUser(i) for i in range(args.players)]
+    # Some first-time submitters who aren't registered yet
+    newcomers = [FakeUser(args.players + i) for i in range(args.burst // 10)]
+    burst = rng.sample(players, k=min(args.burst, len(players))) + newcomers
+    results = {}
+
+    # Half of the newcomers register just before the end, the others are registered by their first /add_score
+    calls = [lambda u=u: handlers['registerUser'](FakeInteraction(u)) for u in newcomers[::2]]
+    results['register'] = await run_scenario('register', calls, args.concurrency, query_count)
+
+    # Everyone submits their final scores at once, a few times each
+    calls = [lambda u=u: handlers['addScore'](FakeInteraction(u), score=rng.randint(0, 1000))
+             for _ in range(args.scores_per_player) for u in burst]
+    results['add_score_burst'] = await run_scenario('add_score_burst', calls, args.concurrency, query_count)
+
+    # Right after, lots of /show of the same scoreboard
+    calls = [lambda u=u: handlers['showScoreboard'](FakeInteraction(u)) for u in burst[:args.shows]]
+    results['show_burst'] = await run_scenario('show_burst', calls, args.concurrency, query_count)
+
+    # Historical /show of a past event
+    calls = [lambda u=u: handlers['showScoreboard'](FakeInteraction(u), past_event=rng.randint(1, args.past_events))
+             for u in burst[:args.shows // 4]]
+    results['show_historical'] = await run_scenario('show_historical', calls, args.concurrency, query_count)
+
+    # People fixing typos: autocomplete keystrokes, then edit
+    fixers = burst[:args.edits]
+    calls = [lambda u=u, typed=typed: handlers['option_autocomplete'](FakeInteraction(u), typed)
+             for u in fixers for typed in ("", "1", "12")]
+    results['autocomplete'] = await run_scenario('autocomplete', calls, args.concurrency, query_count)
+
+    async def edit(user):
+        choices = await handlers['option_autocomplete'](FakeInteraction(user), "")
+        if choices:
+            await handlers['editScore'](FakeInteraction(user), old_score=choices[0].value,
+                                        new_score=str(rng.randint(0, 1000)))
+    calls = [lambda u=u: edit(u) for u in fixers]
+    results['edit_score'] = await run_scenario('edit_score', calls, args.concurrency, query_count)
+
+    async def delete(user):
+        choices = await handlers['option_autocomplete'](FakeInteraction(user), "")
+        if choices:
+            await handlers['deleteScore'](FakeInteraction(user), score_to_delete=choices[-1].value)
+    calls = [lambda u=u: delete(u) for u in fixers[:len(fixers) // 2]]
+    results['delete_score'] = await run_scenario('delete_score', calls, args.concurrency, query_count)
+
+    # Everything interleaved, like the minutes after the event really look
+    calls = []
+    for u in burst:
+        calls.append(lambda u=u: handlers['addScore'](FakeInteraction(u), score=rng.randint(0, 1000)))
+        calls.append(lambda u=u: handlers['option_autocomplete'](FakeInteraction(u), "1"))
+        if rng.random() < 0.3:
+            calls.append(lambda u=u: handlers['showScoreboard'](FakeInteraction(u)))
+    rng.shuffle(calls)
+    results['mixed'] = await run_scenario('mixed', calls, args.concurrency, query_count)
+    return results
+
+
+# ----- baselines -----
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Returns a list of regressions: p95 latency above baseline * (1 + tolerance),
+        or more queries per command than the baseline
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        # Small absolute differences are run-to-run noise on a local database
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance) and current['p95_ms'] - base['p95_ms'] > 5.0:
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if current['queries_per_command'] > base['queries_per_command'] + 0.01:
+            regressions.append(f"{name}: {current['queries_per_command']} queries/cmd "
+                               f"vs baseline {base['queries_per_command']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=3000, help="registered players in the synthetic database")
+    parser.add_argument("--past-events", type=int, default=20, help="finished events with scores")
+    parser.add_argument("--burst", type=int, default=500, help="players submitting at the end of the event")
+    parser.add_argument("--scores-per-player", type=int, default=3)
+    parser.add_argument("--shows", type=int, default=200, help="/show calls right after the event")
+    parser.add_argument("--edits", type=int, default=100, help="players editing/deleting a score")
+    parser.add_argument("--concurrency", type=int, default=50, help="commands in flight at the same time")
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--write-behind", action="store_true", help="enable SCORE_WRITE_BEHIND ingestion")
+    parser.add_argument("--response-budget", type=float, default=2.0,
+                        help="RESPONSE_BUDGET: seconds of work before a response is deferred")
+    parser.add_argument("--seed", type=int, default=99)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative p95 slowdown vs baseline")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fzdbot_bench_")
+    # Settings are read when the fzdbot modules are imported, so set them first
+    os.environ.setdefault("SERVER_ID", "1")
+    os.environ["DB_POOL_SIZE"] = str(args.pool_size)
+    os.environ["SCORE_WRITE_BEHIND"] = "1" if args.write_behind else "0"
+    os.environ["RESPONSE_BUDGET"] = str(args.response_budget)
+    os.environ["SCORE_JOURNAL_PATH"] = os.path.join(workdir, "score_journal.jsonl")
+    os.environ["EVENT_CATALOG_PATH"] = os.path.join(workdir, "event_catalog.json")
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = db_path = os.path.join(workdir, "fzd.sqlite3")
+
+    from benchmarks.seed import create_and_seed
+    from fzdbot.fzd_db import connect_to_database, finalize_ended_events
+    from fzdbot.metrics import metrics
+    from fzdbot.bot import build_client
+
+    summary = create_and_seed(db_path, args.players, args.past_events)
+    print(f"Seeded {summary['players']} players, {summary['past_events']} past events ({db_path})")
+
+    def query_count() -> int: # Statements run by fzd_db so far
+        return sum(entry['calls'] for entry in metrics.snapshot('query'))
+
+    pool = connect_to_database()
+    client = build_client(pool)
+    client.prepare_database() # What the bot does once it has logged in
+    finalize_ended_events(pool, grace_minutes=0) # ...and its background task right after
+    results = asyncio.run(replay_end_of_event(client.handlers, args, query_count))
+    if client.score_ingestor and client.score_ingestor.started:
+        client.score_ingestor.stop()
+    deferred = metrics.deferred()
+    print(f"Deferred responses: {sum(deferred.values())}" + (f" {deferred}" if deferred else ""))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"❌ REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+""" Query plan regression check of the fzd_db queries
+
+    Seeds an embedded SQLite database (schema from the migrations in
+    fzdbot/schema.py, data like the handler benchmark), runs every
+    registered fzd_db call against it with the caches emptied first (so
+    every call really reaches the database) and records the statements they
+    execute. Each recorded SELECT/UPDATE/DELETE/INSERT ... SELECT is then
+    run through EXPLAIN QUERY PLAN: reading a whole table (SCAN) instead of
+    searching an index is a failure, unless the scan is listed in
+    ALLOWED_SCANS with the reason it is fine.
+    It also fails when an instrumented fzd_db function isn't registered, so
+    new queries can't skip the check.
+
+    python -m benchmarks.check_query_plans              # exit 1 on full table scans
+    python -m benchmarks.check_query_plans --verbose    # print every plan
+"""
+import io
+import os
+import re
+import sys
+import argparse
+import tempfile
+
+from fzdbot.metrics import _current as running_function # Set by @instrumented
+
+# (registered call, table) -> why a full scan of that table is expected there
+ALLOWED_SCANS = {
+    ('update_player_stats', 'event_snapshots'):
+        "finds the finalized events not counted yet: an anti-join over every snapshot (one small row per event)",
+}
+
+# Instrumented fzd_db functions that run no query of their own
+NOT_QUERIES = {
+    'connect_to_database': "opens the pool",
+    'migrate_schema': "DDL, runs before the check",
+    'get_cached_user_scores': "in-memory caches only",
+}
+
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"WHERE", "JOIN", "LEFT", "INNER", "ON", "GROUP", "ORDER", "LIMIT", "SET", "VALUES", "SELECT"}
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+class RecordingCursor:
+    """ Cursor wrapper remembering every statement executed through it """
+    def __init__(self, cursor, recorder):
+        self._cursor = cursor
+        self._recorder = recorder
+
+    def execute(self, sql, params=()):
+        self._recorder.record(sql, params)
+        return self._cursor.execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        seq_params = list(seq_params)
+        if seq_params:
+            self._recorder.record(sql, seq_params[0])
+        return self._cursor.executemany(sql, seq_params)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class RecordingConnection:
+    """ A single database connection (fzd_db functions accept one instead of the pool)
+        recording (fzd_db function, sql, params) of everything its cursors execute. The
+        function is the innermost one running (import_scores calls update_player_stats...)
+    """
+    def __init__(self, conn):
+        self._conn = conn
+        self.statements = []
+
+    def record(self, sql, params) -> None:
+        self.statements.append((getattr(running_function, 'name', None), sql, tuple(params or ())))
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def __getattr__(self, attr): # commit, rollback, ...
+        return getattr(self._conn, attr)
+
+
+def registered_calls(fzd_db, ids: dict) -> list:
+    """ [(name, call(db)), ...] exercising every query path of fzd_db. The name before
+        " (" is the fzd_db function, the rest tells apart variants of the same function
+    """
+    guild, other_guild, active, past = ids['guild'], ids['other_guild'], ids['active'], ids['past']
+
+    def past_event(db):
+        return fzd_db.get_scheduled_event(db, guild, past)
+
+    def score_id(db):
+        return fzd_db.get_user_scores(db, guild, "player1")[-1]['id']
+
+    def known_user_scores(db):
+        fzd_db.get_user(db, "player2")
+        return fzd_db.get_user_scores(db, guild, "player2")
+
+    return [
+        ("get_event_types", lambda db: fzd_db.get_event_types(db)),
+        ("get_user", lambda db: fzd_db.get_user(db, "player3")),
+        ("get_user_id", lambda db: fzd_db.get_user_id(db, "player4")),
+        ("check_for_active_event", lambda db: fzd_db.check_for_active_event(db, guild)),
+        ("get_latest_event (any type)", lambda db: fzd_db.get_latest_event(db, guild)),
+        ("get_latest_event (one type)", lambda db: fzd_db.get_latest_event(db, guild, event_id=2)),
+        ("get_scheduled_event", lambda db: fzd_db.get_scheduled_event(db, guild, past)),
+        ("get_recent_events (any type)", lambda db: fzd_db.get_recent_events(db, guild)),
+        ("get_recent_events (one type)", lambda db: fzd_db.get_recent_events(db, guild, event_type=2)),
+        ("get_scoreboard_event", lambda db: fzd_db.get_scoreboard_event(db, guild, event_type=2)),
+        ("get_scoreboard_rows (not finalized)", lambda db: fzd_db.get_scoreboard_rows(db, past_event(db))),
+        ("get_scoreboard_rows (running event)",
+         lambda db: fzd_db.get_scoreboard_rows(db, fzd_db.get_scoreboard_event(db, guild))),
+        ("get_scoreboard_page (not finalized)", lambda db: fzd_db.get_scoreboard_page(db, past_event(db))),
+        ("get_scoreboard_page (not finalized, next)",
+         lambda db: fzd_db.get_scoreboard_page(db, past_event(db), after=(500, "P00100"))),
+        ("get_scoreboard_page (not finalized, previous)",
+         lambda db: fzd_db.get_scoreboard_page(db, past_event(db), before=(500, "P00100"))),
+        ("get_user_scores (unknown user)", lambda db: fzd_db.get_user_scores(db, guild, "player1")),
+        ("get_user_scores (known user)", known_user_scores),
+        ("add_new_user", lambda db: fzd_db.add_new_user(db, _Member("newcomer1"), display_name="NEW1")),
+        ("modify_user_display_name", lambda db: fzd_db.modify_user_display_name(db, 1, "RENAMED")),
+        ("create_event", lambda db: fzd_db.create_event(db, other_guild, {'id': 1, 'name': "Weekly Classic Mini"})),
+        ("add_user_score", lambda db: fzd_db.add_user_score(db, guild, _Member("player1"), 100)),
+        ("resolve_score_target", lambda db: fzd_db.resolve_score_target(db, guild, _Member("newcomer2"))),
+        ("submit_score", lambda db: fzd_db.submit_score(db, [active, 2, 50])),
+        ("submit_score_batch", lambda db: fzd_db.submit_score_batch(db, [[active, 3, 10], [active, 4, 20]],
+                                                                    journal="check.jsonl", last_seq=2)),
+        ("get_journal_checkpoint", lambda db: fzd_db.get_journal_checkpoint(db, "check.jsonl")),
+        ("edit_score", lambda db: fzd_db.edit_score(db, (75, score_id(db)))),
+        ("delete_score", lambda db: fzd_db.delete_score(db, [score_id(db)])),
+        ("finalize_ended_events", lambda db: fzd_db.finalize_ended_events(db, grace_minutes=0)),
+        ("finalize_event", lambda db: fzd_db.finalize_event(db, past)),
+        ("get_scoreboard_rows (finalized)", lambda db: fzd_db.get_scoreboard_rows(db, past_event(db))),
+        ("get_scoreboard_page (finalized)", lambda db: fzd_db.get_scoreboard_page(db, past_event(db))),
+        ("get_scoreboard_page (finalized, next)",
+         lambda db: fzd_db.get_scoreboard_page(db, past_event(db), after=(500, "P00100"))),
+        ("get_scoreboard_page (finalized, previous)",
+         lambda db: fzd_db.get_scoreboard_page(db, past_event(db), before=(500, "P00100"))),
+        ("update_player_stats", lambda db: fzd_db.update_player_stats(db)),
+        ("get_standings", lambda db: fzd_db.get_standings(db, guild, 2)),
+        ("get_player_stats", lambda db: fzd_db.get_player_stats(db, guild, "player1")),
+        ("import_scores", lambda db: fzd_db.import_scores(db, guild, past, [("player5", 10), ("P00006", 20)])),
+        ("export_event_csv (points)", lambda db: fzd_db.export_event_csv(db, guild, past, 'points', io.StringIO())),
+        ("export_event_csv (standings)",
+         lambda db: fzd_db.export_event_csv(db, guild, past, 'standings', io.StringIO())),
+        ("get_event_scoreboard", lambda db: fzd_db.get_event_scoreboard(db, guild)),
+        ("load_live_scoreboard", lambda db: fzd_db.load_live_scoreboard(db, [guild, other_guild])),
+    ]
+
+
+class _Member:
+    """ The discord.Member attributes fzd_db reads """
+    def __init__(self, name: str):
+        self.name = name
+        self.nick = None
+        self.display_name = name
+
+
+def _tables(sql: str) -> dict:
+    """ Name or alias -> table, of every table the statement reads or writes """
+    tables = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        tables[table] = table
+        if alias and alias.upper() not in _NOT_ALIASES:
+            tables[alias] = table
+    return tables
+
+def _explained(sql: str) -> bool:
+    """ Whether the statement has a plan worth checking (not DDL, not a plain INSERT ... VALUES) """
+    words = sql.split()
+    if not words or words[0].upper() not in ("SELECT", "UPDATE", "DELETE", "INSERT"):
+        return False
+    return words[0].upper() != "INSERT" or "SELECT" in sql.upper()
+
+def full_scans(conn, sql: str, params) -> tuple:
+    """ Returns (plan lines, [tables read in full]) of one statement """
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = [row[3] for row in cursor.fetchall()]
+    tables = _tables(sql)
+    scanned = []
+    for detail in plan:
+        match = _SCAN.match(detail)
+        if match and match.group(1) in tables: # Scans of subquery results aren't table scans
+            scanned.append(tables[match.group(1)])
+    return plan, scanned
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=500, help="registered players in the synthetic database")
+    parser.add_argument("--past-events", type=int, default=5, help="finished events with scores")
+    parser.add_argument("--verbose", action="store_true", help="print the plan of every statement")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fzdbot_plans_")
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = db_path = os.path.join(workdir, "fzd.sqlite3")
+
+    from benchmarks.seed import create_and_seed
+    from fzdbot import fzd_db
+    from fzdbot import sqlite_backend
+    from fzdbot.caches import active_event_cache, user_identity_map, user_score_index
+    from fzdbot.scoreboard import live_scoreboard
+
+    summary = create_and_seed(db_path, args.players, args.past_events)
+    ids = {'guild': 1, 'other_guild': 2, 'active': summary['active_scheduled_event_id'], 'past': 1}
+    conn = sqlite_backend.connect(db_path)
+    recorder = RecordingConnection(conn)
+    calls = registered_calls(fzd_db, ids)
+    for name, call in calls:
+        active_event_cache.invalidate()
+        user_identity_map.invalidate()
+        user_score_index.invalidate()
+        live_scoreboard.invalidate()
+        call(recorder)
+
+    failures = []
+    instrumented = {name for name, value in vars(fzd_db).items()
+                    if callable(value) and hasattr(value, '__wrapped__') and value.__module__ == fzd_db.__name__
+                    and not name.startswith('_')}
+    for name in sorted(instrumented - {name.split(" (")[0] for name, _ in calls} - NOT_QUERIES.keys()):
+        failures.append(f"{name}: not registered in benchmarks/check_query_plans.py")
+
+    checked = set()
+    for name, sql, params in recorder.statements:
+        if not _explained(sql) or (name, sql) in checked:
+            continue
+        checked.add((name, sql))
+        plan, scanned = full_scans(conn, sql, params)
+        statement = " ".join(sql.split())
+        bad = [table for table in scanned if (name, table) not in ALLOWED_SCANS]
+        if args.verbose or bad:
+            print(f"{'❌' if bad else '✅'} {name}: {statement[:120]}")
+            for detail in plan:
+                print(f"      {detail}")
+        for table in bad:
+            failures.append(f"{name}: full scan of {table} in {statement[:80]}")
+    conn.close()
+
+    print(f"Checked the plans of {len(checked)} statements from {len(calls)} registered calls")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ No full table scans")
+
+
+if __name__ == '__main__':
+    main()
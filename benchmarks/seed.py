@@ -0,0 +1,49 @@
+""" Synthetic FZD data for the benchmarks, in an embedded SQLite database
+    (created with the schema migrations, like the bot does for DB_BACKEND=sqlite)
+"""
+import sqlite3
+import random
+from datetime import datetime, timedelta, timezone
+
+from fzdbot import sqlite_backend
+from fzdbot.sqlite_backend import TFORMAT
+from fzdbot.fzd_db import migrate_schema
+
+
+def create_and_seed(path: str, players: int, past_events: int, scores_per_player: int = 3,
+                    seed: int = 99, guild_id: int = 1) -> dict:
+    """ Creates the schema and fills it with synthetic data: recurring event types,
+        `players` users, `past_events` finished events with scores, and one event
+        running right now (no scores yet), all of guild guild_id. Returns a summary dict
+    """
+    rng = random.Random(seed)
+    sqlite_backend.create_database(path)
+    conn = sqlite_backend.connect(path)
+    try:
+        migrate_schema(conn, guild_id)
+    finally:
+        conn.close()
+    conn = sqlite3.connect(path)
+    event_types = [(1, "Weekly Classic Mini"), (2, "Grand Prix Party"), (3, "Mirror Madness"),
+                   (4, "Team Battle"), (5, "Special Event")]
+    conn.executemany("INSERT INTO events (id, name, recurring) VALUES (?, ?, 1)", event_types)
+    conn.executemany("INSERT INTO users (tag, discord_user_id) VALUES (?, ?)",
+                     [(f"P{i:05d}", f"player{i}") for i in range(players)])
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for i in range(past_events):
+        start = now - timedelta(days=7 * (past_events - i))
+        cur = conn.execute("INSERT INTO events_scheduled (guild_id, event_id, utc_start_dt, utc_end_dt) VALUES (?, ?, ?, ?)",
+                           (guild_id, rng.randint(1, 5), start.strftime(TFORMAT), (start + timedelta(hours=2)).strftime(TFORMAT)))
+        event_id = cur.lastrowid
+        entrants = rng.sample(range(1, players + 1), k=max(1, players // 2))
+        conn.executemany("INSERT INTO event_result_points (scheduled_event_id, user_id, score) VALUES (?, ?, ?)",
+                         [(event_id, user_id, rng.randint(0, 1000))
+                          for user_id in entrants for _ in range(scores_per_player)])
+
+    cur = conn.execute("INSERT INTO events_scheduled (guild_id, event_id, utc_start_dt, utc_end_dt) VALUES (?, ?, ?, ?)",
+                       (guild_id, 2, (now - timedelta(minutes=90)).strftime(TFORMAT), (now + timedelta(minutes=30)).strftime(TFORMAT)))
+    active_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+    return {'players': players, 'past_events': past_events, 'active_scheduled_event_id': active_id}
@@ -0,0 +1,152 @@
+""" Async wrappers around the functions in fzd_db.py
+
+    Every function here has the same name and arguments as its fzd_db
+    counterpart, but is a coroutine: the blocking mysql.connector call runs
+    on a bounded thread-pool executor so it never stalls the discord.py
+    event loop (heartbeats, other users' interactions, etc.)
+
+    Read functions are also coalesced (single-flight): while a call is
+    running, identical calls (same function and arguments) wait for its
+    result instead of running the same query again, e.g. everyone's /show
+    right after an event ends. Optionally the result is reused for
+    DB_COALESCE_WINDOW more seconds. Every caller gets its own copy of the
+    shared result, so callers can modify what they get back
+"""
+import os
+import copy
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from fzdbot import fzd_db
+from fzdbot.metrics import metrics
+
+_executor = None  # Created lazily so settings from .env are picked up
+_semaphore = None # Created lazily, it has to belong to the running event loop
+_inflight = {}    # (function name, frozen arguments) -> asyncio.Task running that call
+_recent = {}      # (function name, frozen arguments) -> (time finished, result), see coalesce_window()
+
+
+def max_concurrency() -> int:
+    """ Max number of database calls allowed to run at the same time.
+        Defaults to the connection pool size, since each running call holds
+        one pooled connection
+    """
+    return int(os.getenv("DB_MAX_CONCURRENCY", os.getenv("DB_POOL_SIZE", 5)))
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_concurrency(), thread_name_prefix="fzd_db")
+    return _executor
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max_concurrency())
+    return _semaphore
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """ Runs a blocking function on the database executor and waits for it
+        without blocking the event loop. Callers beyond DB_MAX_CONCURRENCY
+        wait here (cancellable) instead of piling up in the executor queue
+    """
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+def coalesce_window() -> float:
+    """ Seconds a coalesced read result is reused after its query finished (0 = only
+        while it runs). Answers can be that much older than the latest writes
+    """
+    return float(os.getenv("DB_COALESCE_WINDOW", 0))
+
+def _freeze(value):
+    """ Hashable version of a call argument (eventinfo dicts, lists, ...) """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _call_finished(key, task) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if task.cancelled() or task.exception() is not None: # Errors are never reused
+        return
+    window = coalesce_window()
+    if window:
+        now = time.monotonic()
+        _recent[key] = (now, task.result())
+        if len(_recent) > 1000: # Drop stale entries now and then
+            for old_key in [k for k, (finished, _) in _recent.items() if now - finished >= window]:
+                del _recent[old_key]
+
+def _coalesced_version(func):
+    """ Like _async_version, with identical concurrent calls sharing one database call
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            key = (name, _freeze(args), _freeze(kwargs))
+            hash(key)
+        except TypeError: # Unhashable argument, nothing to coalesce on
+            return await run_in_db_thread(func, *args, **kwargs)
+
+        recent = _recent.get(key)
+        if recent is not None and time.monotonic() - recent[0] < coalesce_window():
+            metrics.add_coalesced(name)
+            return copy.deepcopy(recent[1])
+
+        task = _inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(run_in_db_thread(func, *args, **kwargs))
+            _inflight[key] = task
+            task.add_done_callback(functools.partial(_call_finished, key))
+        else:
+            metrics.add_coalesced(name)
+        # Shielded: a caller giving up doesn't cancel the query the others are waiting for
+        return copy.deepcopy(await asyncio.shield(task))
+    return wrapper
+
+def _async_version(func):
+    """ Builds a coroutine with the same signature and docstring as a fzd_db function
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(func, *args, **kwargs)
+    return wrapper
+
+
+connect_to_database      = _async_version(fzd_db.connect_to_database)
+get_event_types          = _coalesced_version(fzd_db.get_event_types)
+get_user_id              = _coalesced_version(fzd_db.get_user_id)
+get_user                 = _coalesced_version(fzd_db.get_user)
+add_new_user             = _async_version(fzd_db.add_new_user)
+modify_user_display_name = _async_version(fzd_db.modify_user_display_name)
+create_event             = _async_version(fzd_db.create_event)
+check_for_active_event   = _coalesced_version(fzd_db.check_for_active_event)
+submit_score             = _async_version(fzd_db.submit_score)
+add_user_score           = _async_version(fzd_db.add_user_score)
+resolve_score_target     = _async_version(fzd_db.resolve_score_target)
+edit_score               = _async_version(fzd_db.edit_score)
+delete_score             = _async_version(fzd_db.delete_score)
+get_user_scores          = _coalesced_version(fzd_db.get_user_scores)
+get_cached_user_scores   = fzd_db.get_cached_user_scores # Memory only, never blocks
+get_latest_event         = _coalesced_version(fzd_db.get_latest_event)
+get_scheduled_event      = _coalesced_version(fzd_db.get_scheduled_event)
+get_recent_events        = _coalesced_version(fzd_db.get_recent_events)
+get_event_scoreboard     = _coalesced_version(fzd_db.get_event_scoreboard)
+get_scoreboard_event     = _coalesced_version(fzd_db.get_scoreboard_event)
+get_scoreboard_rows      = _coalesced_version(fzd_db.get_scoreboard_rows)
+get_scoreboard_page      = _coalesced_version(fzd_db.get_scoreboard_page)
+finalize_event           = _async_version(fzd_db.finalize_event)
+finalize_ended_events    = _async_version(fzd_db.finalize_ended_events)
+update_player_stats      = _async_version(fzd_db.update_player_stats)
+get_standings            = _coalesced_version(fzd_db.get_standings)
+get_player_stats         = _coalesced_version(fzd_db.get_player_stats)
+import_scores            = _async_version(fzd_db.import_scores)
+export_event_csv         = _async_version(fzd_db.export_event_csv)
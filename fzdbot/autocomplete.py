@@ -0,0 +1,66 @@
+""" Autocomplete engine for the old_score / score_to_delete options of
+    /edit_score and /delete_score
+
+    Discord gives autocomplete a tight response budget and fires it on every
+    keystroke, so choices are served from the in-memory score index whenever
+    possible (no query, no executor hop). When something isn't cached, one
+    lookup per user is shared by all the keystrokes arriving while it runs,
+    and the result is reused for a short window afterwards
+"""
+import os
+import time
+import asyncio
+
+from discord import app_commands
+
+from fzdbot.fzd_db import get_cached_user_scores
+from fzdbot.async_db import get_user_scores
+
+
+class ScoreAutocomplete:
+    """ Builds the filtered Choice list of a user's scores in the active event
+
+        window: seconds a fetched score list is reused for repeat requests of the same user
+    """
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._inflight = {} # (guild id, user name) -> asyncio.Task fetching their scores
+        self._recent = {}   # (guild id, user name) -> (time fetched, score list)
+
+    async def _user_scores(self, db, guild_id, user_name):
+        scores = get_cached_user_scores(guild_id, user_name)
+        if scores is not None:
+            return scores
+
+        key = (guild_id, user_name)
+        recent = self._recent.get(key)
+        if recent is not None and time.monotonic() - recent[0] < self.window:
+            return recent[1]
+
+        # Coalesce: keystrokes arriving while a lookup runs wait for the same one
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(get_user_scores(db, guild_id, user_name))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        scores = await asyncio.shield(task)
+
+        self._recent[key] = (time.monotonic(), scores)
+        if len(self._recent) > 1000: # Drop stale entries now and then
+            now = time.monotonic()
+            self._recent = {k: v for k, v in self._recent.items() if now - v[0] < self.window}
+        return scores
+
+    async def choices(self, db, guild_id, user_name: str, current: str) -> list[app_commands.Choice[str]]:
+        """ Returns up to 25 (discord limit) Choices of the user's scores in the guild's
+            active event matching what they typed
+        """
+        user_scores = await self._user_scores(db, guild_id, user_name)
+
+        # Filter based on what the user is currently typing
+        current = current.lower()
+        choices = [(opt['score'], opt['id']) for opt in user_scores if current in opt['score'].lower()]
+        return [app_commands.Choice(name=opt, value=f"{opt}|{idopt}") for opt, idopt in choices[:25]]
+
+
+score_autocomplete = ScoreAutocomplete(window=float(os.getenv("AUTOCOMPLETE_WINDOW", 1.0)))
@@ -1,92 +1,285 @@
 # TODO: 
 #    Add Special Event option to "/start_event" - needs new entry in "events" table of database
-#    Add a "before_date" option to "/show" so users can show older results too?
-#    And add pagination to "/show", mostly for large events with a big scoreboard (i.e. GGP)
 
 import os
-from datetime import timezone
+import json
+import asyncio
+import hashlib
+import tempfile
+from datetime import datetime, timezone
 
 # External required modules 
 from dotenv import load_dotenv
+load_dotenv() # Before the local imports, some of them read settings from .env when imported
 import discord
 from discord.ext import commands
+from discord.ext import tasks
 from discord import app_commands
 
 # Local functions 
+# fzd_db.py (blocking, only used at startup before the event loop runs)
 from fzdbot.fzd_db import connect_to_database
-from fzdbot.fzd_db import create_event
 from fzdbot.fzd_db import get_event_types
-from fzdbot.fzd_db import get_user_id
-from fzdbot.fzd_db import get_user_scores
-from fzdbot.fzd_db import submit_score
-from fzdbot.fzd_db import edit_score
-from fzdbot.fzd_db import delete_score
-from fzdbot.fzd_db import check_for_active_event
-from fzdbot.fzd_db import add_new_user
-from fzdbot.fzd_db import modify_user_display_name
-from fzdbot.fzd_db import get_event_scoreboard
+from fzdbot.fzd_db import load_live_scoreboard
+from fzdbot.fzd_db import migrate_schema
+from fzdbot.fzd_db import STATS_VERSION_KEY
+from fzdbot.fzd_db import default_display_name
+from fzdbot.fzd_db import get_pool_stats
+# async_db.py (same API as fzd_db, but runs the queries off the event loop)
+from fzdbot.async_db import create_event
+from fzdbot.async_db import get_user_id
+from fzdbot.async_db import get_user_scores
+from fzdbot.async_db import add_user_score
+from fzdbot.async_db import resolve_score_target
+from fzdbot.async_db import edit_score
+from fzdbot.async_db import delete_score
+from fzdbot.async_db import check_for_active_event
+from fzdbot.async_db import add_new_user
+from fzdbot.async_db import modify_user_display_name
+from fzdbot.async_db import get_scoreboard_event
+from fzdbot.async_db import get_scoreboard_page
+from fzdbot.async_db import get_recent_events
+from fzdbot.async_db import finalize_ended_events
+from fzdbot.async_db import update_player_stats
+from fzdbot.async_db import get_standings
+from fzdbot.async_db import get_player_stats
+from fzdbot.async_db import import_scores
+from fzdbot.async_db import export_event_csv
+from fzdbot.async_db import run_in_db_thread
+# event_catalog.py
+from fzdbot.event_catalog import load_event_catalog
+from fzdbot.event_catalog import save_event_catalog
+# caches.py / render_cache.py
+from fzdbot.caches import score_versions
+from fzdbot.caches import user_identity_map
+from fzdbot.render_cache import render_cache
+# ingest.py
+from fzdbot.ingest import create_score_ingestor
+# responses.py
+from fzdbot.responses import DeferredResponse
+# bulk.py
+from fzdbot.bulk import parse_score_file
+from fzdbot.bulk import ImportFileError
+# metrics.py
+from fzdbot.metrics import metrics
+from fzdbot.metrics import timed_command
+# autocomplete.py
+from fzdbot.autocomplete import score_autocomplete
 # formatters.py
 from fzdbot.formatters import format_discord_timestamp
 from fzdbot.formatters import format_scoreboard_display_text
 from fzdbot.formatters import format_scoreboard_for_discord_embed
+from fzdbot.formatters import format_timing_table
+from fzdbot.formatters import format_standings_display_text
+from fzdbot.formatters import format_player_stats_field
 
 # LOAD INFO FROM .env FILE
-load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
-GUILD_ID = discord.Object(id=os.getenv('SERVER_ID'))
+# Servers the bot runs in: SERVER_IDS (comma separated), or a single SERVER_ID. Each one has its own events,
+# scoreboards and stats. The first one owns the events recorded before the bot supported several servers
+GUILD_IDS = [int(guild_id) for guild_id in os.getenv('SERVER_IDS', os.getenv('SERVER_ID', '')).split(',') if guild_id.strip()]
+GUILDS = [discord.Object(id=guild_id) for guild_id in GUILD_IDS]
+# Hash of the last command tree synced to each guild, so unchanged commands aren't synced again
+COMMAND_SYNC_STATE = os.getenv('COMMAND_SYNC_STATE', 'command_sync.json')
 
 # BOT SETUP
 intents = discord.Intents.default()
 intents.message_content = True  # Required to read message content
 
-class Client(commands.Bot):
+class Client(commands.AutoShardedBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.startup_jobs = []     # Blocking database setup, run off the event loop once the bot logs in
+        self.background_tasks = [] # discord.ext.tasks loops, started after the startup jobs
+        self._startup = None
+
+    async def setup_hook(self) -> None:
+        # Runs once per process (not on gateway reconnects, unlike on_ready)
+        await self.sync_commands()
+        # The bot goes online right away, even if the database takes a while to answer
+        self._startup = asyncio.create_task(self.run_startup_jobs())
+
+    async def run_startup_jobs(self) -> None:
+        for job in self.startup_jobs:
+            while True:
+                try:
+                    await run_in_db_thread(job)
+                    break
+                except Exception as e:
+                    print(f"❌ Startup step {job.__name__} failed ({e}), retrying in 30s")
+                    await asyncio.sleep(30)
+        for task in self.background_tasks:
+            task.start()
+
     async def on_ready(self) -> None:
         print(f'{self.user} is now running!')
+
+    def command_tree_hash(self, guild) -> str:
+        """ Hash of everything a sync sends to Discord for guild (names, descriptions, options, choices, permissions)
+        """
+        definitions = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                             key=lambda definition: definition['name'])
+        return hashlib.sha256(json.dumps(definitions, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def sync_commands(self) -> None:
+        """ Syncs the command tree to each guild, only if it changed since the last successful
+            sync to that guild (syncing on every start runs into Discord's rate limits)
+        """
         try:
-            # Force sync so bot command changes will appear right away
-            synced = await self.tree.sync(guild=GUILD_ID)
-            print(f'Synced {len(synced)} commands to guild {GUILD_ID.id}')
-        except Exception as e:
-            print(f'Wrror syncing commands: {e}')
+            with open(COMMAND_SYNC_STATE, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        changed = False
+        for guild in GUILDS:
+            key = f"{self.application_id}/{guild.id}"
+            tree_hash = self.command_tree_hash(guild)
+            if state.get(key) == tree_hash:
+                print(f'Commands unchanged since last sync to guild {guild.id}, not syncing')
+                continue
+            try:
+                synced = await self.tree.sync(guild=guild)
+                print(f'Synced {len(synced)} commands to guild {guild.id}')
+            except Exception as e:
+                print(f'❌ Error syncing commands to guild {guild.id}: {e}')
+                continue
+            state[key] = tree_hash
+            changed = True
+        if not changed:
+            return
+        try:
+            with open(COMMAND_SYNC_STATE, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=1)
+        except OSError as e:
+            print(f"⚠️  Could not save command sync state to {COMMAND_SYNC_STATE}: {e}")
 
 
-def main() -> None:
+def build_client(db_connect) -> Client:
+    """ Creates the bot client and registers all slash commands on it,
+        db_connect being the database connection pool every command uses.
+        client.handlers gives direct access to the command callbacks (see benchmarks/)
+    """
     # Define bot client according to Client class above
     client = Client(command_prefix="!",intents=intents)
 
-    # Establish database connection
-    db_connect = connect_to_database()
-    if not db_connect:
-        print("Bot cannot start without database connection.")
-        exit(1)
-    
-    # Get all event types from 'events' table
-    recurring_events = get_event_types(db_connect)
-    print(recurring_events)
-    print(repr(recurring_events))
+    # Optional write-behind ingestion of /add_score (None unless SCORE_WRITE_BEHIND is set),
+    # started by prepare_database once the database answers
+    score_ingestor = create_score_ingestor(db_connect)
+    client.score_ingestor = score_ingestor
+
+    def prepare_database() -> None:
+        """ Database setup before the background tasks start (run by Client.run_startup_jobs)
+        """
+        # Tables and indexes the database doesn't have yet (see schema.py). Events from before
+        # the bot ran in several servers belong to the first one
+        migrate_schema(db_connect, GUILD_IDS[0])
+        # Replay scores journaled but not inserted before the last stop (before loading the scoreboards)
+        if score_ingestor and not score_ingestor.started:
+            score_ingestor.start()
+        # Materialize the scoreboards of the running events (kept up to date in memory from here on)
+        load_live_scoreboard(db_connect, GUILD_IDS)
+    client.startup_jobs.append(prepare_database)
+    client.prepare_database = prepare_database
+
+    async def flush_queued_scores(reply=None) -> bool:
+        """ Inserts the queued /add_score submissions before a read that should include them.
+            Returns False if that failed: the read goes ahead with what the database has
+            (the scores stay queued, the flusher thread retries)
+        """
+        if not (score_ingestor and score_ingestor.started):
+            return True
+        try:
+            flush = run_in_db_thread(score_ingestor.flush)
+            await (reply.run(flush) if reply else flush)
+            return True
+        except Exception as e:
+            print(f"❌ Flushing queued scores failed, reading without them: {e}")
+            return False
+
+    @tasks.loop(minutes=float(os.getenv("SNAPSHOT_INTERVAL_MINUTES", 5)))
+    async def finalize_events_task():
+        try:
+            if score_ingestor and score_ingestor.started:
+                await run_in_db_thread(score_ingestor.flush)
+            await finalize_ended_events(db_connect, grace_minutes=int(os.getenv("SNAPSHOT_GRACE_MINUTES", 10)))
+            # Newly finalized events go into the player stats (on the first run: all past events)
+            await update_player_stats(db_connect)
+        except Exception as e:
+            print(f"❌ Finalizing ended events failed: {e}")
+    client.background_tasks.append(finalize_events_task)
+
+    def collect_gauges() -> dict:
+        """ Pool, cache and write-behind queue stats, exported next to the timings in the metrics file """
+        gauges = {}
+        for prefix, stats in (("fzdbot_pool_", get_pool_stats(db_connect)),
+                              ("fzdbot_render_cache_", render_cache.stats()),
+                              ("fzdbot_user_cache_", user_identity_map.stats()),
+                              ("fzdbot_ingest_", score_ingestor.stats() if score_ingestor else {})):
+            gauges.update({prefix + key: value for key, value in stats.items()})
+        return gauges
+
+    # Optional Prometheus text file with all metrics (e.g. for node_exporter's textfile collector)
+    metrics_file = os.getenv("METRICS_FILE")
+    if metrics_file:
+        @tasks.loop(seconds=float(os.getenv("METRICS_INTERVAL_SECONDS", 60)))
+        async def write_metrics_task():
+            try:
+                await run_in_db_thread(metrics.write_prometheus, metrics_file, collect_gauges())
+            except OSError as e:
+                print(f"❌ Writing metrics to {metrics_file} failed: {e}")
+        client.background_tasks.append(write_metrics_task)
+
+    # Get all event types: the copy cached on disk if there is one (no need to wait for the database),
+    # else from the 'events' table. Either way refreshed in the background below
+    recurring_events = load_event_catalog()
+    if recurring_events is None:
+        migrate_schema(db_connect, GUILD_IDS[0]) # First start, the tables may not exist yet
+        recurring_events = get_event_types(db_connect)
+        try:
+            save_event_catalog(recurring_events)
+        except OSError as e:
+            print(f"⚠️  Could not cache event types: {e}")
+    print(f"Event types: {', '.join(e['name'] for e in recurring_events)}")
     
-    # Define event choices for dropdown menus (used in /start_event and /show commands)
+    # Define event choices for dropdown menus (used in /start_event, /show and /standings commands).
+    # The commands share this list object, it's updated in place when the event types change
     event_choices=[ app_commands.Choice(name=e['name'], value=e['id']) for e in recurring_events ]
 
+    @tasks.loop(minutes=float(os.getenv("EVENT_CATALOG_REFRESH_MINUTES", 60)))
+    async def refresh_event_catalog_task():
+        try:
+            events = await run_in_db_thread(get_event_types, db_connect)
+            if events == recurring_events:
+                return
+            recurring_events[:] = events
+            event_choices[:] = [ app_commands.Choice(name=e['name'], value=e['id']) for e in events ]
+            save_event_catalog(events)
+            print(f"Event types changed: {', '.join(e['name'] for e in events)}")
+            await client.sync_commands() # New choices only show up in Discord after a sync
+        except Exception as e:
+            print(f"❌ Refreshing event types failed: {e}")
+    client.background_tasks.append(refresh_event_catalog_task)
+
     
     # =============================================================================================================
     #   /start_event
     # ============================================================================================================= 
     
     # Manually start an event
-    @client.tree.command(name="start_event", description="Choose FZD event to start", guild=GUILD_ID)
+    @client.tree.command(name="start_event", description="Choose FZD event to start", guilds=GUILDS)
     @app_commands.choices(event=event_choices)
+    @timed_command
     async def startEvent(interaction: discord.Interaction, event: app_commands.Choice[int]):
-        current_event = check_for_active_event(db_connect)
+        reply = DeferredResponse(interaction)
+        current_event = await reply.run(check_for_active_event(db_connect, interaction.guild_id))
         if (current_event['name'] != "NULL"):
-            await interaction.response.send_message(f"❌ ERROR! Another event is currently running!")
+            await reply.send(f"❌ ERROR! Another event is currently running!")
             print(f"USER ERROR: User {interaction.user} tried to start {event.name},"
                   f"but there is another event currently running: {current_event['name']}")
         else:
-            current_event['name'] = event.name
-            current_event['id'] = int(event.value)
-            create_event(db_connect, current_event)
-            await interaction.response.send_message(f"✅ FZD event {event.name} successfully started!")
+            new_event = {'name': event.name, 'id': int(event.value)}
+            await reply.run(create_event(db_connect, interaction.guild_id, new_event))
+            await reply.send(f"✅ FZD event {event.name} successfully started!")
             print(f'User {interaction.user} just started the event {event.name}')
  
 
@@ -95,23 +288,27 @@ def main() -> None:
     # ============================================================================================================= 
     
     # Add a score to an event
-    @client.tree.command(name="add_score", description="Add score to FZD scoreboard database", guild=GUILD_ID)
+    @client.tree.command(name="add_score", description="Add score to FZD scoreboard database", guilds=GUILDS)
+    @timed_command
     async def addScore(interaction: discord.Interaction, score: int):
+        reply = DeferredResponse(interaction)
         if score < 0:
-            await interaction.response.send_message(f"⚠️  Please enter a positive integer! ")
+            await reply.send(f"⚠️  Please enter a positive integer! ")
         else:
-            db_user_id = get_user_id(db_connect, interaction.user.name)
-            if db_user_id is None:
-                add_new_user(db_connect, interaction.user, display_name=interaction.user.nick[0:10])
-            current_event = check_for_active_event(db_connect)
+            # First time submitters are registered with their server display name
+            if score_ingestor and score_ingestor.started:
+                current_event, db_user_id = await reply.run(resolve_score_target(db_connect, interaction.guild_id, interaction.user))
+                if (current_event['name'] != "NULL"):
+                    user_data = [current_event['id'], db_user_id, score] 
+                    await reply.run(run_in_db_thread(score_ingestor.submit, user_data)) # Journaled, flushed in batches
+            else:
+                # Event, user (registration) and insert in one transaction (also while write-behind
+                # ingestion waits for the database to start)
+                current_event = await reply.run(add_user_score(db_connect, interaction.guild_id, interaction.user, score))
             if (current_event['name'] != "NULL"):
-                #print(f"current event active: {current_event}")
-                #print(f"{interaction.user}, with id {db_user_id}, entered data")
-                user_data = [current_event['id'], db_user_id, score] 
-                submit_score(db_connect, user_data)
-                await interaction.response.send_message(f"✅ User {interaction.user} has entered a score of {score} to {current_event['name']}")
+                await reply.send(f"✅ User {interaction.user} has entered a score of {score} to {current_event['name']}")
             else: 
-                await interaction.response.send_message(f"❌ ERROR! No event is active, score was not added!  ")
+                await reply.send(f"❌ ERROR! No event is active, score was not added!  ")
 
 
     # =============================================================================================================
@@ -119,22 +316,24 @@ def main() -> None:
     # ============================================================================================================= 
 
     # This command registers a user into the database
-    @client.tree.command(name="register", description="Register your discord id to FZD scoreboard database", guild=GUILD_ID)
+    @client.tree.command(name="register", description="Register your discord id to FZD scoreboard database", guilds=GUILDS)
+    @timed_command
     async def registerUser(interaction: discord.Interaction, display_name: str = None):
+        reply = DeferredResponse(interaction)
         warning=""
         if display_name is None:
-            display_name = interaction.user.nick[0:10]
+            display_name = default_display_name(interaction.user)
         elif len(display_name) > 10:
             display_name = display_name[0:10]
             warning="⚠️  Warning: display_name should be 10 characters or less (as in F-Zero 99 in game name) \n"
         
-        db_user_id = get_user_id(db_connect,interaction.user.name)
+        db_user_id = await reply.run(get_user_id(db_connect,interaction.user.name))
         if db_user_id is None:
-            add_new_user(db_connect, interaction.user, display_name=display_name)
-            await interaction.response.send_message(f"{warning}✅  User {interaction.user} is now registered in the FZD database with display name {display_name}")
+            await reply.run(add_new_user(db_connect, interaction.user, display_name=display_name))
+            await reply.send(f"{warning}✅  User {interaction.user} is now registered in the FZD database with display name {display_name}")
         else:
-            modify_user_display_name(db_connect, db_user_id, display_name)
-            await interaction.response.send_message(f"{warning}✅  User {interaction.user} successfully modified their display name to {display_name}")
+            await reply.run(modify_user_display_name(db_connect, db_user_id, display_name))
+            await reply.send(f"{warning}✅  User {interaction.user} successfully modified their display name to {display_name}")
 
     
     # =============================================================================================================
@@ -142,23 +341,25 @@ def main() -> None:
     # ============================================================================================================= 
     
     # This command queries the database for scores of a current event to edit for a user
-    @client.tree.command(name="edit_score", description="Edit a submitted score, set it to new_score in FZD scoreboard database", guild=GUILD_ID)
+    @client.tree.command(name="edit_score", description="Edit a submitted score, set it to new_score in FZD scoreboard database", guilds=GUILDS)
+    @timed_command
     async def editScore(interaction: discord.Interaction, old_score: str, new_score: str):
-        valid_options = get_user_scores(db_connect, interaction.user.name)
+        reply = DeferredResponse(interaction)
+        valid_options = await reply.run(get_user_scores(db_connect, interaction.guild_id, interaction.user.name))
         score, idchoice = old_score.split("|")
-        score_in_opts = any(d.get('score') == score for d in valid_options)
+        score_in_opts = any(d.get('score') == score and d.get('id') == idchoice for d in valid_options)
         if not score_in_opts:
-            await interaction.response.send_message(f"❌ '{score}' is not a valid choice for you. Please select one of the options shown: {valid_options}", ephemeral=True) 
+            await reply.send(f"❌ '{score}' is not a valid choice for you. Please select one of the options shown: {valid_options}", ephemeral=True) 
         elif score == "NO CURRENT EVENT":
-            await interaction.response.send_message(f"❌  No current event active, can't edit scores! If you need help, contact an FZD mod", ephemeral=True)
+            await reply.send(f"❌  No current event active, can't edit scores! If you need help, contact an FZD mod", ephemeral=True)
         elif score == "NO USER SCORES FOUND":
-            await interaction.response.send_message(f"❌  No submitted scores found for user {interaction.user.name}! If you need help, contact an FZD mod", ephemeral=True)
+            await reply.send(f"❌  No submitted scores found for user {interaction.user.name}! If you need help, contact an FZD mod", ephemeral=True)
         else:
             try:
-               edit_score(db_connect, (int(new_score), idchoice)) 
-               await interaction.response.send_message(f"✅ User {interaction.user.name} has modified submitted score from {score} to {new_score}") 
+               await reply.run(edit_score(db_connect, (int(new_score), idchoice)))
+               await reply.send(f"✅ User {interaction.user.name} has modified submitted score from {score} to {new_score}") 
             except ValueError: # Catching integers this way because autocomplete works with strings only
-               await interaction.response.send_message(f"❌  ERROR! Please enter an integer value!", ephemeral=True) 
+               await reply.send(f"❌  ERROR! Please enter an integer value!", ephemeral=True) 
 
 
     # =============================================================================================================
@@ -177,9 +378,10 @@ def main() -> None:
             self.confirmed = True
             self.stop() # Stop listening for further interactions
             # Execute the action here
-            delete_score(db_connect, [self.idchoice])
-            await interaction.response.edit_message(content=f"Score deleted.", view=None) # Remove buttons
-            await interaction.followup.send(content=f"✅ User {interaction.user.name} has successfully deleted '{self.score}' from their submitted scores", ephemeral=False)
+            reply = DeferredResponse(interaction, name="deleteScore_confirm")
+            await reply.run(delete_score(db_connect, [self.idchoice]))
+            await reply.edit(content=f"Score deleted.", view=None) # Remove buttons
+            await reply.send(f"✅ User {interaction.user.name} has successfully deleted '{self.score}' from their submitted scores", ephemeral=False)
  
         @discord.ui.button(label="No", style=discord.ButtonStyle.red)
         async def cancel_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -193,71 +395,340 @@ def main() -> None:
                 await self.original_interaction.edit_original_response(content="Confirmation timed out.", view=None)
   
     # This command queries the database for scores of a current event to delete for a user
-    @client.tree.command(name="delete_score", description="Delete a score you have submitted during an ongoing event", guild=GUILD_ID)
+    @client.tree.command(name="delete_score", description="Delete a score you have submitted during an ongoing event", guilds=GUILDS)
+    @timed_command
     async def deleteScore(interaction: discord.Interaction, score_to_delete: str):
-        valid_options = get_user_scores(db_connect, interaction.user.name)
+        reply = DeferredResponse(interaction, ephemeral=True) # Only the user sees the confirmation
+        valid_options = await reply.run(get_user_scores(db_connect, interaction.guild_id, interaction.user.name))
         score, idchoice = score_to_delete.split("|")
-        score_in_opts = any(d.get('score') == score for d in valid_options)
+        score_in_opts = any(d.get('score') == score and d.get('id') == idchoice for d in valid_options)
         if not score_in_opts:
-            await interaction.response.send_message(f"❌ '{score}' is not a valid choice for you. Please select one of the options shown: {valid_options}", ephemeral=True)
+            await reply.send(f"❌ '{score}' is not a valid choice for you. Please select one of the options shown: {valid_options}", ephemeral=True)
         elif score == "NO CURRENT EVENT":
-            await interaction.response.send_message(f"❌  No current event active, can't edit scores! If you need help, contact an FZD mod", ephemeral=True)
+            await reply.send(f"❌  No current event active, can't edit scores! If you need help, contact an FZD mod", ephemeral=True)
         elif score == "NO USER SCORES FOUND":
-            await interaction.response.send_message(f"❌  No submitted scores found for user {interaction.user.name}! If you need help, contact an FZD mod", ephemeral=True)
+            await reply.send(f"❌  No submitted scores found for user {interaction.user.name}! If you need help, contact an FZD mod", ephemeral=True)
         else:
             view = ConfirmDeleteScore(interaction)
             view.score = score # Send score to the ConfirmDeleteScore class
             view.idchoice = idchoice # Send id of the score to ConfirmDeleteScore class
-            await interaction.response.send_message(f"⚠️  Are you sure you want to delete '{score}' from your scores?",
+            await reply.send(f"⚠️  Are you sure you want to delete '{score}' from your scores?",
                         view=view,  ephemeral=True) 
             await view.wait() # Wait for user to make choice
 
     # Autocomplete handler for editScore and deleteScore (same for both)
     @editScore.autocomplete("old_score")
     @deleteScore.autocomplete("score_to_delete")
+    @timed_command
     async def option_autocomplete(interaction: discord.Interaction, current: str):
-        user_scores = get_user_scores(db_connect, interaction.user.name)
-  
-        # Filter based on what the user is currently typing
-        choices = [(opt['score'], opt['id']) for opt in user_scores if current.lower() in opt['score'].lower()]
-        # Return up to 25 results (discord limit)
-        return [app_commands.Choice(name=opt, value=f"{opt}|{idopt}") for opt, idopt in choices[:25]] 
+        # Served from memory when possible, see autocomplete.py
+        return await score_autocomplete.choices(db_connect, interaction.guild_id, interaction.user.name, current)
  
 
     # =============================================================================================================
     #   /show = Show results of FZD event in discord embed
     # ============================================================================================================= 
 
-    @client.tree.command(name="show", description="Show most current FZD event scoreboard", guild=GUILD_ID)
+    # Players per /show page, each page is fetched on demand with a keyset query
+    page_size = int(os.getenv("SCOREBOARD_PAGE_SIZE", 10))
+
+    def render_scoreboard_page(eventinfo, rows, total, page_no):
+        """ Builds the embed of one scoreboard page, returns it with its field blocks
+        """
+        ranked_scoreboard = format_scoreboard_display_text(rows)
+        eventdate = eventinfo['utc_start_dt'].replace(tzinfo=timezone.utc)
+
+        scoreboard = discord.Embed(title=eventinfo['name'], description=f"*Played on {format_discord_timestamp(eventdate)}*")
+        scoreboard.set_thumbnail(url="https://media.discordapp.net/attachments/1399501477608951933/1400792457007861800/Supernova_Server_Icon.png?ex=689c6da3&is=689b1c23&hm=68b8d8790d30689fbad0dfb9341c78921ecf9afecc5919880c81680329c32644&=&format=webp&quality=lossless&width=1024&height=1024") 
+    
+        fields_display_text = format_scoreboard_for_discord_embed(ranked_scoreboard, max_num_lines=page_size)
+        for i, block in enumerate(fields_display_text, start=1):
+            scoreboard.add_field(name="", value=block, inline=False)
+        num_pages = -(-total // page_size)
+        if num_pages > 1:
+            scoreboard.set_footer(text=f"Page {page_no + 1}/{num_pages} · {total} players")
+        return {'fields': fields_display_text, 'embed': scoreboard, 'rows': rows, 'total': total}
+
+    # Previous/next buttons for /show, pages are fetched lazily and kept while the view lives
+    class ScoreboardPager(discord.ui.View):
+        def __init__(self, original_interaction, eventinfo, first_page):
+            super().__init__(timeout=180)
+            self.original_interaction = original_interaction
+            self.eventinfo = eventinfo
+            self.pages = [first_page]
+            self.page_no = 0
+            self.update_buttons()
+
+        def update_buttons(self):
+            page = self.pages[self.page_no]
+            self.previous_button.disabled = self.page_no == 0
+            self.next_button.disabled = (self.page_no + 1) * page_size >= page['total']
+
+        async def interaction_check(self, interaction: discord.Interaction) -> bool:
+            # Only the user who ran /show flips its pages
+            return interaction.user.id == self.original_interaction.user.id
+
+        async def show_page(self, interaction: discord.Interaction, page_no: int):
+            reply = DeferredResponse(interaction, name="showScoreboard_page")
+            if page_no == len(self.pages):
+                last_row = self.pages[-1]['rows'][-1]
+                rows, total = await reply.run(get_scoreboard_page(db_connect, self.eventinfo, page_size,
+                                                                  after=(last_row['score'], last_row['player'])))
+                if not rows: # Scoreboard shrank since the first page
+                    page_no -= 1
+                else:
+                    self.pages.append(render_scoreboard_page(self.eventinfo, rows, total, page_no))
+            self.page_no = page_no
+            self.update_buttons()
+            await reply.edit(embed=self.pages[page_no]['embed'], view=self)
+
+        @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.gray)
+        async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+            await self.show_page(interaction, self.page_no - 1)
+
+        @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.gray)
+        async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+            await self.show_page(interaction, self.page_no + 1)
+
+        async def on_timeout(self):
+            await self.original_interaction.edit_original_response(view=None) # Remove buttons
+
+    @client.tree.command(name="show", description="Show most current FZD event scoreboard", guilds=GUILDS)
+    @app_commands.describe(before_date="Show the latest event played before this date (YYYY-MM-DD)",
+                           past_event="Show a specific past event")
     @app_commands.choices(event_type=event_choices)
-    async def showScoreboard(interaction: discord.Interaction, event_type: int = None):
-        eventinfo, eventscoreslist = get_event_scoreboard(db_connect, event_type=event_type)
-        if eventinfo and eventscoreslist:
-            ranked_scoreboard = format_scoreboard_display_text(eventscoreslist)
-            eventdate = eventinfo['utc_start_dt'].replace(tzinfo=timezone.utc)
-
-            scoreboard = discord.Embed(title=eventinfo['name'], description=f"*Played on {format_discord_timestamp(eventdate)}*")
-            scoreboard.set_thumbnail(url="https://media.discordapp.net/attachments/1399501477608951933/1400792457007861800/Supernova_Server_Icon.png?ex=689c6da3&is=689b1c23&hm=68b8d8790d30689fbad0dfb9341c78921ecf9afecc5919880c81680329c32644&=&format=webp&quality=lossless&width=1024&height=1024") 
-        
-            fields_display_text = format_scoreboard_for_discord_embed(ranked_scoreboard, max_num_lines=10)
-            #for lin in fields_display_text:
-            #    print(lin)
-            #print(len(fields_display_text))
-            for i, block in enumerate(fields_display_text, start=1):
-                scoreboard.add_field(name="", value=block, inline=False)
-            await interaction.response.send_message(embed=scoreboard)   
+    @timed_command
+    async def showScoreboard(interaction: discord.Interaction, event_type: int = None,
+                             before_date: str = None, past_event: int = None):
+        reply = DeferredResponse(interaction)
+        before = None
+        if before_date is not None:
+            try:
+                before = datetime.strptime(before_date, "%Y-%m-%d")
+            except ValueError:
+                await reply.send(f"❌  '{before_date}' is not a valid date, please use YYYY-MM-DD", ephemeral=True)
+                return
+        await flush_queued_scores(reply) # Make sure queued scores are counted
+        eventinfo = await reply.run(get_scoreboard_event(db_connect, interaction.guild_id, event_type=event_type,
+                                                         before=before, scheduled_event_id=past_event))
+        rendered = None
+        if eventinfo:
+            # Rendered first pages are cached per event, score data version and display options
+            render_options = ('page_size', page_size)
+            data_version = score_versions.get(eventinfo['id'])
+            rendered = render_cache.get(eventinfo['id'], data_version, render_options)
+            if rendered is None:
+                rows, total = await reply.run(get_scoreboard_page(db_connect, eventinfo, page_size))
+                if rows:
+                    rendered = render_scoreboard_page(eventinfo, rows, total, 0)
+                    render_cache.put(eventinfo['id'], data_version, render_options, rendered)
+        if rendered:
+            if rendered['total'] > page_size:
+                view = ScoreboardPager(interaction, eventinfo, rendered)
+                await reply.send(embed=rendered['embed'], view=view)
+            else:
+                await reply.send(embed=rendered['embed'])   
         else:
-            event_name = [e['name'] for e in recurring_events if e['id'] == event_type]
-            await interaction.response.send_message(
+            event_name = [e['name'] for e in recurring_events if e['id'] == event_type] or ["latest event"]
+            await reply.send(
                   f"⚠️  No results found for event_type '{event_name[0]}'! If this is unexpected behavior contact a mod!",
                   ephemeral=True
                   )
 
+    # Autocomplete handler for past_event in /show: most recent finished events (of the chosen event_type)
+    @showScoreboard.autocomplete("past_event")
+    @timed_command
+    async def past_event_autocomplete(interaction: discord.Interaction, current: str):
+        recent = await get_recent_events(db_connect, interaction.guild_id, event_type=interaction.namespace.event_type)
+        choices = [(f"{e['name']} ({e['utc_start_dt']:%Y-%m-%d})", e['id']) for e in recent]
+        return [app_commands.Choice(name=name, value=sid) for name, sid in choices if current.lower() in name.lower()][:25]
+
+    # =============================================================================================================
+    #   /standings = Season standings of one event type, /player_stats = Stats of one player
+    # ============================================================================================================= 
+
+    @client.tree.command(name="standings", description="Show the all-time standings of an FZD event type", guilds=GUILDS)
+    @app_commands.describe(top="Number of players to show (default 20)")
+    @app_commands.choices(event_type=event_choices)
+    @timed_command
+    async def showStandings(interaction: discord.Interaction, event_type: int, top: app_commands.Range[int, 1, 50] = 20):
+        reply = DeferredResponse(interaction)
+        # Rendered standings are cached until the stats change (next finished event or name change)
+        render_options = ('top', top)
+        data_version = score_versions.get((STATS_VERSION_KEY, interaction.guild_id))
+        render_key = ('standings', interaction.guild_id, event_type)
+        rendered = render_cache.get(render_key, data_version, render_options)
+        if rendered is None:
+            rows, events_held = await reply.run(get_standings(db_connect, interaction.guild_id, event_type, limit=top))
+            if rows:
+                event_name = [e['name'] for e in recurring_events if e['id'] == event_type] or ["FZD"]
+                standings = discord.Embed(title=f"{event_name[0]} standings",
+                                          description=f"*Total points over {events_held} finished events*")
+                fields_display_text = format_scoreboard_for_discord_embed(format_standings_display_text(rows), max_num_lines=top)
+                for block in fields_display_text:
+                    standings.add_field(name="", value=block, inline=False)
+                rendered = {'fields': fields_display_text, 'embed': standings}
+                render_cache.put(render_key, data_version, render_options, rendered)
+        if rendered:
+            await reply.send(embed=rendered['embed'])
+        else:
+            await reply.send("⚠️  No finished events of this type yet!", ephemeral=True)
+
+    @client.tree.command(name="player_stats", description="Show FZD statistics of a player (you by default)", guilds=GUILDS)
+    @app_commands.describe(player="Player to show the stats of")
+    @timed_command
+    async def playerStats(interaction: discord.Interaction, player: discord.Member = None):
+        reply = DeferredResponse(interaction)
+        member = player or interaction.user
+        player_stats = await reply.run(get_player_stats(db_connect, interaction.guild_id, member.name))
+        if not player_stats:
+            await reply.send(f"⚠️  No finished events found for {member.name}!", ephemeral=True)
+            return
+        embed = discord.Embed(title=f"Stats of {getattr(member, 'display_name', member.name)}")
+        for event_stats in player_stats[:25]: # Embeds hold 25 fields at most
+            embed.add_field(name=event_stats['name'], value=format_player_stats_field(event_stats), inline=False)
+        await reply.send(embed=embed)
+
+    # =============================================================================================================
+    #   /import_scores = Bulk score upload from a CSV/JSON file, /export_scores = Event data as CSV (mods only)
+    # ============================================================================================================= 
+
+    import_max_bytes = int(os.getenv("IMPORT_MAX_BYTES", 5_000_000))
+
+    @timed_command
+    async def scheduled_event_autocomplete(interaction: discord.Interaction, current: str):
+        # The running event (if any) and the most recent finished ones
+        recent = await get_recent_events(db_connect, interaction.guild_id)
+        active_event = await check_for_active_event(db_connect, interaction.guild_id)
+        choices = [(f"{e['name']} ({e['utc_start_dt']:%Y-%m-%d})", e['id']) for e in recent]
+        if active_event['name'] != "NULL":
+            choices.insert(0, (f"{active_event['name']} (running now)", active_event['id']))
+        return [app_commands.Choice(name=name, value=sid) for name, sid in choices if current.lower() in name.lower()][:25]
+
+    @client.tree.command(name="import_scores", description="Import scores of an event from a CSV or JSON file (mods only)", guilds=GUILDS)
+    @app_commands.describe(event="Event to add the scores to",
+                           file="CSV with 'player' and 'score' columns, or JSON list of {\"player\", \"score\"}")
+    @app_commands.autocomplete(event=scheduled_event_autocomplete)
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @timed_command
+    async def importScores(interaction: discord.Interaction, event: int, file: discord.Attachment):
+        if file.size > import_max_bytes:
+            await interaction.response.send_message(f"❌  {file.filename} is too big ({file.size} bytes, max {import_max_bytes})", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            rows = parse_score_file(file.filename, await file.read())
+        except ImportFileError as e:
+            await interaction.followup.send(f"❌  Could not read {file.filename}: {e}", ephemeral=True)
+            return
+        if not rows:
+            await interaction.followup.send(f"⚠️  No scores found in {file.filename}", ephemeral=True)
+            return
+        try:
+            summary = await import_scores(db_connect, interaction.guild_id, event, rows)
+        except ValueError as e:
+            await interaction.followup.send(f"❌  {e}", ephemeral=True)
+            return
+        print(f"User {interaction.user} imported {summary['imported']} scores into scheduled event {event}")
+        message = f"✅  Imported {summary['imported']} of {len(rows)} scores from {file.filename}"
+        for label, players in (("Not registered", summary['unknown']), ("Tag of several users", summary['ambiguous'])):
+            if players:
+                message += f"\n⚠️  {label}, skipped: {', '.join(players)}"
+        await interaction.followup.send(message[:2000], ephemeral=True)
+
+    @client.tree.command(name="export_scores", description="Download the scores of an event as CSV (mods only)", guilds=GUILDS)
+    @app_commands.describe(event="Event to export", kind="Ranked standings (default) or every submitted score")
+    @app_commands.choices(kind=[app_commands.Choice(name="standings", value="standings"),
+                                app_commands.Choice(name="all points", value="points")])
+    @app_commands.autocomplete(event=scheduled_event_autocomplete)
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @timed_command
+    async def exportScores(interaction: discord.Interaction, event: int, kind: str = "standings"):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        complete = await flush_queued_scores() # Make sure queued scores are exported
+        # Streamed to a temporary file, then uploaded from there
+        fd, path = tempfile.mkstemp(prefix="fzd_export_", suffix=".csv")
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as out:
+                rows = await export_event_csv(db_connect, interaction.guild_id, event, kind, out)
+            if not rows:
+                await interaction.followup.send("⚠️  No scores found for this event", ephemeral=True)
+                return
+            warning = "" if complete else "\n⚠️  Scores submitted in the last minutes couldn't be written yet and may be missing"
+            await interaction.followup.send(f"✅  {rows} rows{warning}", file=discord.File(path, filename=f"event_{event}_{kind}.csv"),
+                                            ephemeral=True)
+        finally:
+            os.remove(path)
+
+    # =============================================================================================================
+    #   /bot_stats = Timings of commands and database calls (mods only)
+    # ============================================================================================================= 
+
+    @client.tree.command(name="bot_stats", description="Show command and database timings (mods only)", guilds=GUILDS)
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def botStats(interaction: discord.Interaction):
+        uptime = datetime.fromtimestamp(metrics.started, timezone.utc)
+        stats = discord.Embed(title="Bot stats", description=f"*Collected since {format_discord_timestamp(uptime)}, times in ms*")
+        stats.add_field(name="Commands", value=format_timing_table(metrics.snapshot('command')), inline=False)
+        stats.add_field(name="Database calls", value=format_timing_table(metrics.snapshot('db'), show_rows=True), inline=False)
+        stats.add_field(name="SQL time per call", value=format_timing_table(metrics.snapshot('query'), max_rows=5), inline=False)
+        slow = [f"{name} {seconds * 1000:.0f} ms: {sql[:80]}" for _, name, seconds, sql in list(metrics.slow_queries)[-5:]]
+        stats.add_field(name=f"Slow queries ({metrics.slow_query_count} total)",
+                        value="```\n" + "\n".join(slow)[:1000] + "\n```" if slow else "None", inline=False)
+        coalesced = sorted(metrics.coalesced().items(), key=lambda item: item[1], reverse=True)
+        if coalesced:
+            stats.add_field(name="Coalesced calls (queries saved)", inline=False,
+                            value="\n".join(f"{name}: {count}" for name, count in coalesced)[:1024])
+        deferred = sorted(metrics.deferred().items(), key=lambda item: item[1], reverse=True)
+        if deferred:
+            stats.add_field(name="Deferred responses (work past the response budget)", inline=False,
+                            value="\n".join(f"{name}: {count}" for name, count in deferred)[:1024])
+        gauges = collect_gauges()
+        stats.add_field(name="Pool / caches", inline=False,
+                        value="\n".join(f"{name.removeprefix('fzdbot_')}: {value:.3g}" if isinstance(value, float)
+                                        else f"{name.removeprefix('fzdbot_')}: {value}" for name, value in gauges.items())[:1024])
+        await interaction.response.send_message(embed=stats, ephemeral=True)
+
+    client.handlers = {
+        'startEvent': startEvent.callback,
+        'addScore': addScore.callback,
+        'registerUser': registerUser.callback,
+        'editScore': editScore.callback,
+        'deleteScore': deleteScore.callback,
+        'option_autocomplete': option_autocomplete,
+        'showScoreboard': showScoreboard.callback,
+        'past_event_autocomplete': past_event_autocomplete,
+        'showStandings': showStandings.callback,
+        'playerStats': playerStats.callback,
+        'importScores': importScores.callback,
+        'exportScores': exportScores.callback,
+        'scheduled_event_autocomplete': scheduled_event_autocomplete,
+        'botStats': botStats.callback,
+    }
+    return client
+
+
+def main() -> None:
+    # Establish database connection. Once the event types are cached on disk the bot doesn't need to
+    # wait for the database to start (the first start checks the connection, to catch bad settings)
+    db_connect = connect_to_database(check=load_event_catalog() is None)
+    if not db_connect:
+        print("Bot cannot start without database connection.")
+        exit(1)
+
+    client = build_client(db_connect)
+
     # =============================================================================================================
     #   Run the bot!
     # =============================================================================================================     
     
     client.run(token=TOKEN)
 
+    if client.score_ingestor and client.score_ingestor.started:
+        client.score_ingestor.stop() # Last flush of queued scores before exiting
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,79 @@
+""" Parsing of /import_scores attachments
+
+    Mods can upload the results of an event as a file instead of entering
+    them one /add_score at a time:
+      CSV:  a header row with 'player' and 'score' columns (others are ignored),
+            or no header at all, just "player,score" lines
+      JSON: [{"player": ..., "score": ...}, ...] or [["player", score], ...]
+    'player' is the discord username or the scoreboard tag of a registered user.
+    Players may appear on several rows, every row is one score like /add_score
+"""
+import io
+import csv
+import json
+
+
+class ImportFileError(ValueError):
+    """ The attachment can't be imported, the message says why (shown to the mod) """
+
+
+def _score(value, where: str) -> int:
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ImportFileError(f"{where}: score '{value}' is not a whole number") from None
+
+def _parse_csv(text: str) -> list[tuple[str, int]]:
+    lines = list(csv.reader(io.StringIO(text)))
+    if not lines:
+        return []
+    header = [cell.strip().lower() for cell in lines[0]]
+    if 'player' in header and 'score' in header:
+        player_col, score_col = header.index('player'), header.index('score')
+        lines, first_line = lines[1:], 2
+    else:
+        player_col, score_col, first_line = 0, 1, 1
+    rows = []
+    for line_no, line in enumerate(lines, start=first_line):
+        if not any(cell.strip() for cell in line):
+            continue
+        if len(line) <= max(player_col, score_col):
+            raise ImportFileError(f"line {line_no}: expected a player and a score")
+        player = line[player_col].strip()
+        if not player:
+            raise ImportFileError(f"line {line_no}: empty player")
+        rows.append((player, _score(line[score_col], f"line {line_no}")))
+    return rows
+
+def _parse_json(text: str) -> list[tuple[str, int]]:
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ImportFileError(f"invalid JSON ({e})") from None
+    if not isinstance(data, list):
+        raise ImportFileError("JSON must be a list of {\"player\": ..., \"score\": ...} entries")
+    rows = []
+    for index, entry in enumerate(data):
+        if isinstance(entry, dict) and 'player' in entry and 'score' in entry:
+            player, score = entry['player'], entry['score']
+        elif isinstance(entry, list) and len(entry) == 2:
+            player, score = entry
+        else:
+            raise ImportFileError(f"entry {index}: expected {{\"player\": ..., \"score\": ...}}")
+        player = str(player).strip()
+        if not player:
+            raise ImportFileError(f"entry {index}: empty player")
+        rows.append((player, _score(score, f"entry {index}")))
+    return rows
+
+def parse_score_file(filename: str, data: bytes) -> list[tuple[str, int]]:
+    """ Returns the [(player, score), ...] rows of an uploaded file, raises
+        ImportFileError if it isn't a valid CSV or JSON score list
+    """
+    try:
+        text = data.decode("utf-8-sig") # Spreadsheet exports often start with a BOM
+    except UnicodeDecodeError:
+        raise ImportFileError("file is not UTF-8 text") from None
+    if filename.lower().endswith(".json") or text.lstrip().startswith("["):
+        return _parse_json(text)
+    return _parse_csv(text)
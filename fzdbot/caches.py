@@ -0,0 +1,297 @@
+""" In-process caches in front of the hottest fzd_db queries.
+
+    They are shared by every thread running fzd_db calls, so all of them
+    are guarded by a lock
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class ActiveEventCache:
+    """ Remembers the currently active scheduled event of each guild (or that there is none).
+
+        The active event only changes when create_event() runs (which calls
+        invalidate()) or when a time boundary is crossed, so the cached value
+        expires exactly at the active event's utc_end_dt, or at the next
+        scheduled event's utc_start_dt when nothing is running.
+        max_ttl caps how long a value is kept, in case events get scheduled
+        by something other than this bot.
+
+        The lock only guards the dict, loader() runs outside of it: peek() is
+        called on the event loop and must never wait for a query. Concurrent
+        misses of the same guild share one load (single-flight)
+    """
+    def __init__(self, max_ttl: float = 300.0):
+        self.max_ttl = max_ttl
+        self._lock = threading.Lock()
+        self._entries = {} # guild_id -> (active event or None, time.monotonic() deadline)
+        self._loading = {} # guild_id -> threading.Event set when the running load is over
+        self._generation = 0 # Bumped by invalidate(), loads started before that aren't stored
+
+    def get_or_load(self, guild_id, loader):
+        """ Returns the cached active event of guild_id (dict, or None if no event is active).
+            On a miss calls loader(), which must return (event or None, seconds the value stays valid).
+            Threads missing while another one loads the same guild wait for its result
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(guild_id)
+                if entry is not None and time.monotonic() < entry[1]:
+                    return entry[0]
+                loading = self._loading.get(guild_id)
+                if loading is None:
+                    loading = self._loading[guild_id] = threading.Event()
+                    loading.result = None # (event,) once loaded
+                    generation = self._generation
+                    break
+            loading.wait()
+            if loading.result is not None:
+                return loading.result[0]
+            # The load failed or was invalidated meanwhile, look again
+        try:
+            event, valid_for = loader()
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[guild_id] = (event, time.monotonic() + max(0.0, min(valid_for, self.max_ttl)))
+                    loading.result = (event,)
+            return event
+        finally:
+            with self._lock:
+                del self._loading[guild_id]
+            loading.set()
+
+    def peek(self, guild_id):
+        """ Returns (cached: bool, active event or None) of guild_id without ever querying
+        """
+        with self._lock:
+            entry = self._entries.get(guild_id)
+            if entry is not None and time.monotonic() < entry[1]:
+                return True, entry[0]
+            return False, None
+
+    def is_active(self, scheduled_event_id) -> bool:
+        """ Whether scheduled_event_id is the cached active event of some guild """
+        now = time.monotonic()
+        with self._lock:
+            return any(event is not None and event['id'] == scheduled_event_id and now < expires
+                       for event, expires in self._entries.values())
+
+    def invalidate(self, guild_id=None) -> None:
+        with self._lock:
+            self._generation += 1
+            if guild_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(guild_id, None)
+
+
+class UserIdentityMap:
+    """ Bounded LRU map of discord_user_id -> database user record
+        ({'id': int, 'player': display name used on scoreboards}).
+
+        Unknown users are remembered for miss_ttl seconds (negative caching),
+        so an unregistered user spamming autocomplete doesn't hit the database
+        on every keystroke. add_new_user / modify_user_display_name write through
+    """
+    _NOT_FOUND = object()
+
+    def __init__(self, capacity: int = 5000, miss_ttl: float = 30.0):
+        self.capacity = capacity
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # discord_user_id -> (record or _NOT_FOUND, expiry or None)
+        self._by_id = {}              # database user id -> discord_user_id
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def lookup(self, discord_id):
+        """ Returns (found_in_cache: bool, record or None)
+        """
+        with self._lock:
+            entry = self._entries.get(discord_id)
+            if entry is not None:
+                record, expiry = entry
+                if record is self._NOT_FOUND:
+                    if time.monotonic() < expiry:
+                        self.negative_hits += 1
+                        self._entries.move_to_end(discord_id)
+                        return True, None
+                    del self._entries[discord_id]
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(discord_id)
+                    return True, record
+            self.misses += 1
+            return False, None
+
+    def _store(self, discord_id, value, expiry) -> None:
+        old = self._entries.pop(discord_id, None)
+        if old is not None and old[0] is not self._NOT_FOUND:
+            self._by_id.pop(old[0]['id'], None)
+        self._entries[discord_id] = (value, expiry)
+        if value is not self._NOT_FOUND:
+            self._by_id[value['id']] = discord_id
+        while len(self._entries) > self.capacity:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            if evicted is not self._NOT_FOUND:
+                self._by_id.pop(evicted['id'], None)
+
+    def put(self, discord_id, user_id: int, player: str) -> None:
+        with self._lock:
+            self._store(discord_id, {'id': user_id, 'player': player}, None)
+
+    def put_missing(self, discord_id) -> None:
+        with self._lock:
+            self._store(discord_id, self._NOT_FOUND, time.monotonic() + self.miss_ttl)
+
+    def update_player(self, user_id: int, player: str) -> None:
+        """ Write-through for a display name change of a known database user id
+        """
+        with self._lock:
+            discord_id = self._by_id.get(user_id)
+            if discord_id is not None:
+                self._entries[discord_id] = ({'id': user_id, 'player': player}, None)
+
+    def player_for(self, user_id: int):
+        """ Scoreboard name of a cached database user id, None if not cached
+            (doesn't count as a lookup or refresh the LRU order)
+        """
+        with self._lock:
+            discord_id = self._by_id.get(user_id)
+            if discord_id is None:
+                return None
+            return self._entries[discord_id][0]['player']
+
+    def invalidate(self) -> None:
+        """ Forgets every user (e.g. after users were changed outside the bot) """
+        with self._lock:
+            self._entries.clear()
+            self._by_id.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+
+class UserScoreIndex:
+    """ Per user, per scheduled event lists of submitted scores, kept in sync by
+        submit_score / edit_score / delete_score so /edit_score and /delete_score
+        autocomplete can be answered without a query.
+
+        A (user_id, scheduled_event_id) list is only ever complete: it is created
+        from a full query (load), and new scores are appended only to lists that
+        are already loaded. Least recently used lists are dropped past capacity
+    """
+    def __init__(self, capacity: int = 2000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._lists = OrderedDict() # (user_id, scheduled_event_id) -> {score_id: score} (in id order)
+        self._scores = {}           # score_id -> (user_id, scheduled_event_id)
+
+    def get(self, user_id, scheduled_event_id):
+        """ Returns [(score_id, score), ...] ordered by id, or None if not loaded
+        """
+        key = (user_id, scheduled_event_id)
+        with self._lock:
+            scores = self._lists.get(key)
+            if scores is None:
+                return None
+            self._lists.move_to_end(key)
+            return list(scores.items())
+
+    def load(self, user_id, scheduled_event_id, rows) -> None:
+        """ rows = [(score_id, score), ...] as returned by the database """
+        key = (user_id, scheduled_event_id)
+        with self._lock:
+            self._drop(key)
+            self._lists[key] = {int(score_id): int(score) for score_id, score in rows}
+            for score_id in self._lists[key]:
+                self._scores[score_id] = key
+            while len(self._lists) > self.capacity:
+                self._drop(next(iter(self._lists)))
+
+    def _drop(self, key) -> None:
+        for score_id in self._lists.pop(key, {}):
+            self._scores.pop(score_id, None)
+
+    def add(self, user_id, scheduled_event_id, score_id: int, score: int) -> None:
+        key = (user_id, scheduled_event_id)
+        with self._lock:
+            scores = self._lists.get(key)
+            if scores is not None:
+                scores[int(score_id)] = int(score)
+                self._scores[int(score_id)] = key
+
+    def lookup(self, score_id: int):
+        """ Returns (user_id, scheduled_event_id, score) for a known score id, else None
+        """
+        with self._lock:
+            key = self._scores.get(int(score_id))
+            if key is None:
+                return None
+            return key[0], key[1], self._lists[key][int(score_id)]
+
+    def edit(self, score_id: int, score: int) -> None:
+        with self._lock:
+            key = self._scores.get(int(score_id))
+            if key is not None:
+                self._lists[key][int(score_id)] = int(score)
+
+    def delete(self, score_id: int) -> None:
+        with self._lock:
+            key = self._scores.pop(int(score_id), None)
+            if key is not None:
+                del self._lists[key][int(score_id)]
+
+    def invalidate(self, user_id=None, scheduled_event_id=None) -> None:
+        """ Drops one (user, event) list, or everything if no key is given """
+        with self._lock:
+            if user_id is None:
+                self._lists.clear()
+                self._scores.clear()
+            else:
+                self._drop((user_id, scheduled_event_id))
+
+
+class ScoreVersions:
+    """ Data version of each scheduled event's scores, bumped by every write
+        to them. Anything derived from an event's scores (e.g. rendered /show
+        embeds) can be cached under (scheduled_event_id, version) and never
+        needs explicit invalidation. bump_all() covers writes whose event
+        isn't known and display name changes
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._versions = {}
+
+    def get(self, scheduled_event_id) -> tuple:
+        with self._lock:
+            return self._epoch, self._versions.get(scheduled_event_id, 0)
+
+    def bump(self, scheduled_event_id) -> None:
+        with self._lock:
+            self._versions[scheduled_event_id] = self._versions.get(scheduled_event_id, 0) + 1
+
+    def bump_all(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._versions.clear()
+
+
+active_event_cache = ActiveEventCache(max_ttl=float(os.getenv("ACTIVE_EVENT_CACHE_TTL", 300)))
+user_identity_map = UserIdentityMap(capacity=int(os.getenv("USER_CACHE_SIZE", 5000)),
+                                    miss_ttl=float(os.getenv("USER_CACHE_MISS_TTL", 30)))
+user_score_index = UserScoreIndex(capacity=int(os.getenv("SCORE_INDEX_SIZE", 2000)))
+score_versions = ScoreVersions()
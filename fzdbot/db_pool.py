@@ -0,0 +1,197 @@
+""" Thread-safe database connection pool used by fzd_db.py
+
+    Connections are handed out per call and taken back afterwards, checked
+    for validity on checkout, and transparently reopened (with exponential
+    backoff) when the server has dropped them, e.g. after an idle night
+"""
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection could be checked out in time """
+
+
+class ConnectionPool:
+    """ Fixed-size pool of database connections.
+
+        connect: callable with no arguments returning a new connection object
+                 (must provide ping(), commit(), rollback() and close())
+        size: max number of open connections
+        checkout_timeout: seconds to wait for a free connection before giving up
+        ping_after: connections idle for longer than this (seconds) are pinged on checkout
+        reconnect_attempts / reconnect_delay: retries (and initial delay, doubled
+                 after each failure) when (re)opening a connection
+    """
+    def __init__(self, connect, size: int = 5, checkout_timeout: float = 10.0,
+                 ping_after: float = 10.0, reconnect_attempts: int = 5,
+                 reconnect_delay: float = 0.5):
+        self._connect = connect
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+
+        self._idle = queue.LifoQueue() # (connection, time it was returned)
+        self._lock = threading.Lock()
+        self._open = 0
+
+        # Metrics
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._reconnects = 0
+        self._failed_checks = 0
+        self._timeouts = 0
+
+    def _open_connection(self):
+        """ Opens a new connection, retrying with exponential backoff
+        """
+        delay = self.reconnect_delay
+        for attempt in range(1, self.reconnect_attempts + 1):
+            try:
+                return self._connect()
+            except Exception as err:
+                if attempt == self.reconnect_attempts:
+                    raise
+                print(f"⚠️  Database connection attempt {attempt} failed ({err}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay *= 2
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if time.monotonic() - idle_since < self.ping_after:
+            return True
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+
+    def _reserve_and_open(self):
+        """ Opens a new connection counted against the pool size
+            (the caller must have checked there's room)
+        """
+        try:
+            return self._open_connection()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def checkout(self):
+        """ Takes a healthy connection out of the pool (opening one if there is room).
+            Must be given back with checkin()
+        """
+        start = time.monotonic()
+        try:
+            conn, idle_since = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                room = self._open < self.size
+                if room:
+                    self._open += 1
+            if room:
+                conn, idle_since = self._reserve_and_open(), None
+            else:
+                try:
+                    conn, idle_since = self._idle.get(timeout=self.checkout_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+
+        if idle_since is not None and not self._is_healthy(conn, idle_since):
+            # Server dropped it (idle timeout, restart, ...), replace it
+            print("⚠️  Dropped database connection detected, reconnecting")
+            self._discard(conn)
+            with self._lock:
+                self._failed_checks += 1
+                self._open += 1
+            conn = self._reserve_and_open()
+            with self._lock:
+                self._reconnects += 1
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def checkin(self, conn, broken: bool = False) -> None:
+        """ Gives a connection back to the pool, or closes it if it's broken
+        """
+        with self._lock:
+            self._in_use -= 1
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """ Context manager version of checkout()/checkin(). The transaction always
+            ends before the connection goes back to the pool: committed if the block
+            succeeded, rolled back if it raised. Otherwise a read-only call would leave
+            a transaction open (autocommit is off) and later calls on that connection
+            would keep reading its old snapshot. If ending it fails, the connection is
+            treated as broken and closed
+        """
+        conn = self.checkout()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        else:
+            try:
+                conn.commit()
+            except Exception:
+                broken = True
+                raise
+        finally:
+            self.checkin(conn, broken=broken)
+
+    def stats(self) -> dict:
+        """ Pool metrics: open/in-use/idle connections, checkout wait times
+            and how many times connections had to be reopened
+        """
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'wait_avg_ms': 1000 * self._wait_total / self._checkouts if self._checkouts else 0.0,
+                'wait_max_ms': 1000 * self._wait_max,
+                'failed_health_checks': self._failed_checks,
+                'reconnects': self._reconnects,
+                'timeouts': self._timeouts,
+            }
+
+    def close(self) -> None:
+        """ Closes every idle connection """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
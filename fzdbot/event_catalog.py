@@ -0,0 +1,41 @@
+""" On-disk copy of the event catalog (the 'events' table)
+
+    The recurring event types define the choices of /start_event, /show and
+    /standings, so they are needed before any command can be registered.
+    Keeping the last known list in a small JSON file (EVENT_CATALOG_PATH)
+    lets the bot build its commands and come online without waiting for the
+    database; the list is refreshed from the database in the background
+    and the file rewritten whenever it changes
+"""
+import os
+import json
+
+
+def catalog_path() -> str:
+    return os.getenv("EVENT_CATALOG_PATH", "event_catalog.json")
+
+def load_event_catalog(path: str = None):
+    """ Returns the cached [{'id': ..., 'name': ...}, ...], None if there is no usable file
+    """
+    path = path or catalog_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            events = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring unreadable event catalog {path}: {e}")
+        return None
+    if not isinstance(events, list) or not all(isinstance(e, dict) and {'id', 'name'} <= e.keys() for e in events):
+        print(f"⚠️  Ignoring malformed event catalog {path}")
+        return None
+    return [{'id': int(e['id']), 'name': str(e['name'])} for e in events]
+
+def save_event_catalog(events, path: str = None) -> None:
+    """ Writes the catalog atomically (a crash never leaves a half-written file)
+    """
+    path = path or catalog_path()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump([{'id': e['id'], 'name': e['name']} for e in events], f, indent=1)
+    os.replace(tmp_path, path)
@@ -22,6 +22,8 @@ def format_scoreboard_display_text(allscores) -> list[str]:
          and outputs a list of text lines for each player, 
          where each line contains rank, player name, and scores
          (with some other formatting/flair for a nice-looking scoreboard display)
+         Entries that already carry a 'rank' (e.g. one page of a paginated
+         scoreboard) keep it instead
     """    
     rank=0
     last_score = None 
@@ -30,7 +32,9 @@ def format_scoreboard_display_text(allscores) -> list[str]:
     for iscore, entry in enumerate(allscores):
         player = entry['player']
         score = int(entry['score'])
-        if score != last_score:
+        if 'rank' in entry:
+            rank = entry['rank']
+        elif score != last_score:
             rank = iscore + 1
     
         emoji=""
@@ -42,7 +46,8 @@ def format_scoreboard_display_text(allscores) -> list[str]:
             emoji=":third_place: "
        
         if not isBelowPodium and rank > 3:
-            scoreboard.append("===================================")
+            if scoreboard: # No separator at the top of a page that starts below the podium
+                scoreboard.append("===================================")
             isBelowPodium = True
         
         # If we don't escape the dot ("\\.") discord might see the rank as markdown text 
@@ -80,3 +85,41 @@ def format_scoreboard_for_discord_embed(lines: list[str],
         formatted_fields.append(curstr)
     
     return formatted_fields  
+
+def format_timing_table(summary: list[dict], max_rows: int = 10, show_rows: bool = False) -> str:
+    """ Renders metrics.snapshot() entries as a monospace table (wrapped in a code
+        block) for a discord embed field, slowest total time first
+    """
+    if not summary:
+        return "No calls yet"
+    header = f"{'name':<24}{'calls':>7}{'p50':>7}{'p95':>7}{'max':>7}{'err':>5}" + (f"{'rows':>8}" if show_rows else "")
+    lines = [header]
+    for entry in summary[:max_rows]:
+        line = (f"{entry['name'][:23]:<24}{entry['calls']:>7}{entry['p50_ms']:>7.1f}"
+                f"{entry['p95_ms']:>7.1f}{entry['max_ms']:>7.0f}{entry['errors']:>5}")
+        if show_rows:
+            line += f"{entry['rows']:>8}"
+        lines.append(line)
+    text = "\n".join(lines)
+    return f"```\n{text[:1000]}\n```" # Embed fields hold 1024 characters at most
+
+def format_standings_display_text(standings) -> list[str]:
+    """ Lines of the season standings (rows of fzd_db.get_standings), same
+        look as the scoreboard: rank, player, total, then events played,
+        average and wins
+    """
+    lines = []
+    for entry in standings:
+        rank = entry['rank']
+        emoji = {1: ":trophy: ", 2: ":second_place: ", 3: ":third_place: "}.get(rank, "")
+        wins = f", {entry['wins']} :trophy:" if entry['wins'] else ""
+        lines.append(f"{emoji}{rank}\\. **{entry['player']}** -- {entry['total_score']} pts "
+                     f"*({entry['events_played']} events, avg {entry['average']:.0f}{wins})*")
+    return lines
+
+def format_player_stats_field(stats: dict) -> str:
+    """ Text of one event type in /player_stats (an entry of fzd_db.get_player_stats) """
+    participation = stats['events_played'] / stats['events_held'] if stats['events_held'] else 0
+    return (f"Played **{stats['events_played']}** of {stats['events_held']} events ({participation:.0%})\n"
+            f"Total **{stats['total_score']}** pts, average **{stats['average']:.0f}**, best **{stats['best_score']}**\n"
+            f"Best finish **#{stats['best_finish']}** · {stats['wins']} wins · {stats['podiums']} podiums")
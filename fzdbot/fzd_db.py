@@ -1,217 +1,1075 @@
 import os
+import re
+import csv
+import sqlite3
 import mysql.connector
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 
-def connect_to_database():
-    """ Establishes onnecttion to FZD database
-    """
-    config = {
+from fzdbot import sqlite_backend
+from fzdbot import schema
+from fzdbot.db_pool import ConnectionPool
+from fzdbot.caches import active_event_cache
+from fzdbot.caches import user_identity_map
+from fzdbot.caches import user_score_index
+from fzdbot.caches import score_versions
+from fzdbot.scoreboard import live_scoreboard
+from fzdbot import stats
+from fzdbot.metrics import instrumented
+from fzdbot.metrics import instrument_connection
+
+def _mysql_config() -> dict:
+    return {
       'user': os.getenv("DB_USER"),
       'password': os.getenv("DB_PASSWORD"),
       'host': os.getenv("DB_HOST", "localhost"),
       'database': os.getenv("DB_NAME"),
       'port': int(os.getenv("DB_PORT", 3306)),
-      'raise_on_warnings': True 
+      'raise_on_warnings': True,
+      # Results are read completely on execute (like SQLite), cursor(buffered=False) streams instead
+      'buffered': True
     }
+
+def _backend() -> str:
+    return os.getenv("DB_BACKEND", "mysql").lower()
+
+# Ranked scoreboards use window functions (RANK() OVER, COUNT(*) OVER ())
+MIN_MYSQL_VERSION = (8, 0)
+MIN_MARIADB_VERSION = (10, 2)
+
+def _server_version(server_info: str) -> tuple:
+    """ ('MySQL' or 'MariaDB', (major, minor)) from a server version string like
+        '8.0.36' or '5.5.5-10.6.16-MariaDB' (MariaDB's old replication prefix)
+    """
+    product = "MariaDB" if "mariadb" in server_info.lower() else "MySQL"
+    version = re.sub(r"^5\.5\.5-", "", server_info)
+    match = re.match(r"(\d+)\.(\d+)", version)
+    return product, (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+def _connect_mysql(config):
+    """ Opens a MySQL connection, refusing servers too old for the scoreboard queries """
+    conn = mysql.connector.connect(**config)
+    product, version = _server_version(conn.server_info or "")
+    required = MIN_MARIADB_VERSION if product == "MariaDB" else MIN_MYSQL_VERSION
+    if version < required:
+        conn.close()
+        raise mysql.connector.NotSupportedError(
+            msg=f"fzdbot needs MySQL {'.'.join(map(str, MIN_MYSQL_VERSION))}+ or MariaDB "
+                f"{'.'.join(map(str, MIN_MARIADB_VERSION))}+ (window functions), the server is {product} {conn.server_info}")
+    return conn
+
+@instrumented
+def connect_to_database(check=True):
+    """ Establishes connection pool to FZD database, sized with DB_POOL_SIZE.
+        DB_BACKEND selects the database: "mysql" (default, DB_HOST/DB_USER/...)
+        or "sqlite" (embedded database file at SQLITE_PATH, see sqlite_backend.py).
+        Opens a first connection right away so bad credentials are caught at startup,
+        returns None if that fails. With check=False that is skipped (connections
+        are opened by the first queries), so the caller doesn't wait for the database
+    """
+    backend = _backend()
+    if backend == "sqlite":
+        path = os.getenv("SQLITE_PATH", "fzd.sqlite3")
+        try:
+            sqlite_backend.create_database(path)
+        except sqlite3.Error as err:
+            print(f"❌ Database connection failed: {err}")
+            return None
+        connect, connect_errors = (lambda: sqlite_backend.connect(path)), sqlite3.Error
+    elif backend == "mysql":
+        config = _mysql_config()
+        connect = lambda: _connect_mysql(config)
+        connect_errors = mysql.connector.Error
+    else:
+        print(f"❌ Unknown DB_BACKEND '{backend}', use mysql or sqlite")
+        return None
+
+    pool = ConnectionPool(
+        connect,
+        size=int(os.getenv("DB_POOL_SIZE", 5)),
+        checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        ping_after=float(os.getenv("DB_POOL_PING_AFTER", 10)),
+        reconnect_attempts=int(os.getenv("DB_RECONNECT_ATTEMPTS", 5)),
+        reconnect_delay=float(os.getenv("DB_RECONNECT_DELAY", 0.5)),
+    )
+    if not check:
+        print(f"✅ Using {backend} database (pool size {pool.size}), connecting on first use")
+        return pool
     try:
-        db = mysql.connector.connect(**config)
-        if db.is_connected():
-            print("✅ Connected to database")
-            return db
-    except mysql.connector.Error as err:
+        with pool.connection() as db:
+            if db.is_connected():
+                print(f"✅ Connected to {backend} database (pool size {pool.size})")
+                return pool
+    except connect_errors as err:
         print(f"❌ Database connection failed: {err}")
         return None
 
+@contextmanager
+def _connection(db):
+    """ Hands out a connection for the duration of one call. db can be a
+        ConnectionPool (normal case) or a single connection object.
+        Its cursors are timed and counted, see metrics.py
+    """
+    if isinstance(db, ConnectionPool):
+        with db.connection() as conn:
+            yield instrument_connection(conn)
+    else:
+        yield instrument_connection(db)
+
+@instrumented
+def migrate_schema(db, default_guild_id) -> int:
+    """ Applies the schema migrations (schema.MIGRATIONS) the database doesn't have yet,
+        in order. default_guild_id = guild that events from before guilds belong to.
+        Returns how many migrations were applied
+    """
+    sql_getapplied = "SELECT version FROM schema_migrations;"
+    sql_markapplied = """INSERT INTO schema_migrations (version, description, applied_at)
+                         VALUES (%s, %s, UTC_TIMESTAMP());"""
+    backend = _backend()
+    applied_now = 0
+    with _connection(db) as conn, conn.cursor() as cursor:
+        schema.create_table(cursor, 'schema_migrations')
+        cursor.execute(sql_getapplied)
+        applied = {row[0] for row in cursor.fetchall()}
+        for version, description, migration in schema.MIGRATIONS:
+            if version in applied:
+                continue
+            migration(cursor, backend, default_guild_id)
+            cursor.execute(sql_markapplied, (version, description))
+            conn.commit()
+            print(f"Applied database migration {version}: {description}")
+            applied_now += 1
+    if applied_now:
+        print(f"Database schema is at version {schema.SCHEMA_VERSION}")
+        # Migrations may have merged duplicate users, forget the cached ids
+        user_identity_map.invalidate()
+        user_score_index.invalidate()
+    return applied_now
+
+def get_pool_stats(db) -> dict:
+    """ Returns connection pool metrics (in use, wait times, reconnects, ...)
+    """
+    if isinstance(db, ConnectionPool):
+        return db.stats()
+    return {}
+
+@instrumented
 def get_event_types(db):
     """ Get event types and ids of recurring events from 'events' table
     """ 
-    cursor = db.cursor(dictionary=True) # Pass back results as dict
-    sql_gettypes = "SELECT id, name FROM events WHERE recurring = 1"
-    cursor.execute(sql_gettypes)
-    eventtypes = cursor.fetchall()
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        sql_gettypes = "SELECT id, name FROM events WHERE recurring = 1 ORDER BY id"
+        cursor.execute(sql_gettypes)
+        eventtypes = cursor.fetchall()
     
     return eventtypes #[{'id': 7, 'name': 'Weekly Classic Mini'} . . .
 
+_SQL_GET_USER = """SELECT id, COALESCE(tag, discord_display_name, discord_user_id) AS player
+                   FROM users WHERE discord_user_id = %s"""
+
+# Registers a user, or leaves the existing row alone if they are registered already (two first-time
+# commands of the same user can't create duplicates, discord_user_id is a UNIQUE key).
+# Either way lastrowid is the user's id
+_SQL_UPSERT_USER = """INSERT INTO users (tag, discord_user_id) VALUES (%s, %s)
+                      ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id);"""
+# /register: same, but the chosen name also replaces the tag of an existing row
+_SQL_REGISTER_USER = """INSERT INTO users (tag, discord_user_id) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE tag = VALUES(tag), id = LAST_INSERT_ID(id);"""
+
+@instrumented
 def get_user_id(db, discord_id: str):
     """ Given a discord user id (discord_id), returns the database
-        id of that user
+        id of that user (served from user_identity_map when possible)
     """
-    cursor = db.cursor(dictionary=True) 
-    sql_getuser = "SELECT id from users WHERE discord_user_id = %s"
-    cursor.execute(sql_getuser, [discord_id])
-    user = cursor.fetchone()
+    user = get_user(db, discord_id)
     if user:
         return user['id']
     else:
         return None
 
+@instrumented
+def get_user(db, discord_id: str):
+    """ Given a discord user id (discord_id), returns a dict with the database
+        id of that user and the name shown for them on scoreboards, or None
+        if the user isn't registered
+    """
+    cached, user = user_identity_map.lookup(discord_id)
+    if cached:
+        return user
+
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(_SQL_GET_USER, [discord_id])
+        user = cursor.fetchone()
+    if user:
+        user_identity_map.put(discord_id, user['id'], user['player'])
+    else:
+        user_identity_map.put_missing(discord_id)
+    return user
+
+def default_display_name(member) -> str:
+    """ Name a user gets when they don't pick one: their server nickname, else their
+        discord display name (nick is None without a server nickname), cut to 10
+        characters like F-Zero 99 in game names
+    """
+    return (member.nick or member.display_name)[0:10]
+
+@instrumented
 def add_new_user(db, discord_username, display_name=None) -> None:
     """ Adds new user to the database
     """ 
-    cursor = db.cursor(dictionary=True)
-    
     # Assuming "discord_display_name" isn't required 
-    sql_newuser="INSERT INTO users (tag, discord_user_id) VALUES (%s, %s);"
-
     if display_name is None: # Defaults to user's server display name 
-        display_name = discord_username.nick[0:10]
+        display_name = default_display_name(discord_username)
 
-    cursor.execute(sql_newuser, (display_name, discord_username.name)) #, discord_username.name))
-    db.commit()
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(_SQL_REGISTER_USER, (display_name, discord_username.name))
+        conn.commit()
+        new_user_id = cursor.lastrowid
+    user_identity_map.put(discord_username.name, new_user_id, display_name)
 
+@instrumented
 def modify_user_display_name(db, db_user_id, display_name) -> None:
     """ Modifies an existing user's display name in the database
     """
-    cursor = db.cursor(dictionary=True)
-
     sql_modifyuser="UPDATE users SET tag = %s WHERE id = %s;"
-    cursor.execute(sql_modifyuser, (display_name, db_user_id))
-    db.commit()
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_modifyuser, (display_name, db_user_id))
+        conn.commit()
+    user_identity_map.update_player(db_user_id, display_name)
+    live_scoreboard.invalidate() # Name shown on the scoreboard changed
+    score_versions.bump_all()
 
-def create_event(db, event) -> None:
-    """ Inserts new event into the 'events_scheduled' database
+@instrumented
+def create_event(db, guild_id, event) -> None:
+    """ Inserts new event of guild guild_id into the 'events_scheduled' database
     """
     now = datetime.now(timezone.utc) #now.strftime('%Y-%m-%d %H:%M:%S')
     endtime =  now + timedelta(hours=2)
     tformat = '%Y-%m-%d %H:%M:%S'
     
-    cursor = db.cursor(dictionary=True)
-    sql_addevent = "INSERT INTO events_scheduled (event_id, utc_start_dt, utc_end_dt) VALUES (%s, %s, %s);"
-    cursor.execute(sql_addevent, (event['id'], now.strftime(tformat), endtime.strftime(tformat)) )
-    db.commit()
+    sql_addevent = "INSERT INTO events_scheduled (guild_id, event_id, utc_start_dt, utc_end_dt) VALUES (%s, %s, %s, %s);"
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_addevent, (guild_id, event['id'], now.strftime(tformat), endtime.strftime(tformat)) )
+        conn.commit()
+    active_event_cache.invalidate(guild_id)
 
-def check_for_active_event(db):
-    """ Checks database event times start and end times to see if
-        event is active right now, returns dict with name and id
+def _load_active_event(db, guild_id):
+    """ Fetches the active event of a guild, or else its next scheduled one, from the database.
+        Returns (active event dict or None, seconds until that answer changes)
     """
-    active_event = {'name':"NULL",'id':0} # Assume no match
-
-    cursor = db.cursor(dictionary=True)
-
-    sql_getevent="""SELECT es.id, e.name, es.utc_start_dt, es.utc_end_dt 
+    # Earliest event that hasn't ended yet: either running now or the next one to start.
+    # db_now is used to compute expiry so clock skew between bot and database doesn't matter
+    sql_getevent="""SELECT es.id, es.event_id, e.name, es.utc_start_dt, es.utc_end_dt,
+                           UTC_TIMESTAMP() AS db_now
                     FROM events_scheduled es
                     JOIN events e ON e.id = es.event_id
-                    WHERE UTC_TIMESTAMP() BETWEEN utc_start_dt AND utc_end_dt;"""
-    cursor.execute(sql_getevent)
-    eventmatch = cursor.fetchone()
+                    WHERE es.guild_id = %s AND es.utc_end_dt >= UTC_TIMESTAMP()
+                    ORDER BY es.utc_start_dt ASC
+                    LIMIT 1;"""
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_getevent, [guild_id])
+        eventmatch = cursor.fetchone()
+
+    if not eventmatch:
+        return None, float('inf') # Nothing scheduled, only create_event (or max ttl) changes that
+    db_now = eventmatch.pop('db_now')
+    if eventmatch['utc_start_dt'] > db_now:
+        return None, (eventmatch['utc_start_dt'] - db_now).total_seconds()
+    # BETWEEN is inclusive, so the event is still active during its last second
+    return eventmatch, (eventmatch['utc_end_dt'] - db_now).total_seconds() + 1
+
+@instrumented
+def check_for_active_event(db, guild_id):
+    """ Checks database event times start and end times to see if an
+        event of the guild is active right now, returns dict with name and id
+        (Served from active_event_cache until the next start/end time)
+    """
+    active_event = {'name':"NULL",'id':0} # Assume no match
+
+    eventmatch = active_event_cache.get_or_load(guild_id, lambda: _load_active_event(db, guild_id))
     if eventmatch:
         active_event['name'] = eventmatch['name']
         active_event['id']   = eventmatch['id']
 
     return active_event
 
+_SQL_NEW_SCORE = "INSERT INTO event_result_points (scheduled_event_id, user_id, score) VALUES (%s, %s, %s);"
+
+@instrumented
 def submit_score(db, dataentry) -> None:
     """ Executes sql query command to insert data to database
-        db = database connection object
-        dataentry = [ scheduled_event_id, user_id, lineup_id, score ] - all integers
+        db = database connection pool (or connection object)
+        dataentry = [ scheduled_event_id, user_id, score ] - all integers
+    """
+    scheduled_event_id, user_id, score = dataentry
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(_SQL_NEW_SCORE, dataentry)
+        conn.commit()
+        new_score_id = cursor.lastrowid
+        live_scoreboard.apply(scheduled_event_id, user_identity_map.player_for(user_id), int(score), 1)
+    score_versions.bump(scheduled_event_id)
+    user_score_index.add(user_id, scheduled_event_id, new_score_id, score)
+
+def _resolve_user(cursor, member) -> dict:
+    """ {'id', 'player'} of a discord member, registering them with their default
+        display name if they aren't yet. Runs on the caller's cursor/transaction,
+        the caller commits and stores the result in user_identity_map
+    """
+    cached, user = user_identity_map.lookup(member.name)
+    if not cached:
+        cursor.execute(_SQL_GET_USER, [member.name])
+        user = cursor.fetchone()
+    if user is None:
+        display_name = default_display_name(member)
+        cursor.execute(_SQL_UPSERT_USER, (display_name, member.name))
+        # The row may already exist (a concurrent /register, or a stale negative
+        # cache entry): report the name the database holds, not the one we tried
+        cursor.execute(_SQL_GET_USER, [member.name])
+        user = cursor.fetchone()
+    return user
+
+@instrumented
+def add_user_score(db, guild_id, member, score) -> dict:
+    """ All of /add_score in one transaction on one connection: finds the active
+        event, finds the discord member (registering them with their default display
+        name on their first score) and inserts the score. With the event and user cached (the normal
+        case) that is a single INSERT.
+        Returns the active event like check_for_active_event, name "NULL" meaning
+        no event is running and nothing was written
+    """
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        active_event = check_for_active_event(conn, guild_id)
+        if active_event['name'] == "NULL":
+            return active_event
+        user = _resolve_user(cursor, member)
+        cursor.execute(_SQL_NEW_SCORE, (active_event['id'], user['id'], score))
+        conn.commit()
+        new_score_id = cursor.lastrowid
+        live_scoreboard.apply(active_event['id'], user['player'], int(score), 1)
+    user_identity_map.put(member.name, user['id'], user['player'])
+    score_versions.bump(active_event['id'])
+    user_score_index.add(user['id'], active_event['id'], new_score_id, score)
+    return active_event
+
+@instrumented
+def resolve_score_target(db, guild_id, member):
+    """ Active event and user id for a score that is queued instead of inserted
+        right away (write-behind /add_score), registering the user if needed.
+        Returns (active event like check_for_active_event, user id or None if no event is running)
+    """
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        active_event = check_for_active_event(conn, guild_id)
+        if active_event['name'] == "NULL":
+            return active_event, None
+        user = _resolve_user(cursor, member)
+        conn.commit()
+    user_identity_map.put(member.name, user['id'], user['player'])
+    return active_event, user['id']
+
+def _reopen_finalized(cursor, scheduled_event_ids) -> list:
+    """ Scores added to an event after it was finalized (/import_scores, a late
+        write-behind flush or journal replay) make its snapshot and player stats stale.
+        In the caller's transaction, so it commits together with the scores: drops the
+        snapshot (/show ranks the raw points again, finalize_ended_events snapshots the
+        event anew) and uncounts the player stats of its event type (update_player_stats
+        counts them again). Returns the ids of the events that had a snapshot
+    """
+    sql_getfinalized = """SELECT es.guild_id, se.event_id AS counted_event_id
+                          FROM event_snapshots snap
+                          JOIN events_scheduled es ON es.id = snap.scheduled_event_id
+                          LEFT JOIN stats_events se ON se.scheduled_event_id = snap.scheduled_event_id
+                          WHERE snap.scheduled_event_id = %s;"""
+    sql_dropsnapshot = "DELETE FROM event_snapshots WHERE scheduled_event_id = %s;"
+    sql_uncountstats = "DELETE FROM player_stats WHERE guild_id = %s AND event_id = %s;"
+    sql_uncountevents = "DELETE FROM stats_events WHERE guild_id = %s AND event_id = %s;"
+    reopened = []
+    for scheduled_event_id in scheduled_event_ids:
+        cursor.execute(sql_getfinalized, [scheduled_event_id])
+        finalized = cursor.fetchone()
+        if finalized is None:
+            continue
+        cursor.execute(sql_dropsnapshot, [scheduled_event_id])
+        if finalized['counted_event_id'] is not None:
+            cursor.execute(sql_uncountstats, (finalized['guild_id'], finalized['counted_event_id']))
+            cursor.execute(sql_uncountevents, (finalized['guild_id'], finalized['counted_event_id']))
+        reopened.append(scheduled_event_id)
+    return reopened
+
+def _refinalize(db, reopened) -> None:
+    """ Rebuilds right away what _reopen_finalized dropped once the scores are committed.
+        If this doesn't happen (crash, database error) finalize_events_task does it later
     """
-    cursor = db.cursor(dictionary=True)
-    sql_newrow="INSERT INTO event_result_points (scheduled_event_id, user_id, score) VALUES (%s, %s, %s);"
-    cursor.execute(sql_newrow, dataentry)
-    db.commit()
+    try:
+        for scheduled_event_id in reopened:
+            total_players = finalize_event(db, scheduled_event_id)
+            print(f"Finalized scoreboard snapshot of scheduled event {scheduled_event_id} again ({total_players} players)")
+        if reopened:
+            update_player_stats(db)
+    except (mysql.connector.Error, sqlite3.Error) as err: # The scores are in, don't fail their caller
+        print(f"❌ Rebuilding the snapshot of scheduled events {reopened} failed, left to the next finalize run: {err}")
+
+@instrumented
+def submit_score_batch(db, dataentries, journal=None, last_seq=None) -> None:
+    """ Inserts many scores with a single executemany, in one transaction
+        dataentries = [ [ scheduled_event_id, user_id, score ], ... ]
+        journal / last_seq = optional write-behind journal checkpoint, stored in the same
+                             transaction so a replay after a crash never inserts twice
+        Events that were finalized in the meantime get their snapshot and player stats rebuilt
+    """
+    sql_checkpoint="""INSERT INTO score_journal_checkpoint (journal, last_seq) VALUES (%s, %s)
+                      ON DUPLICATE KEY UPDATE last_seq = %s;"""
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.executemany(_SQL_NEW_SCORE, dataentries)
+        reopened = _reopen_finalized(cursor, sorted({entry[0] for entry in dataentries}))
+        if journal is not None:
+            cursor.execute(sql_checkpoint, (journal, last_seq, last_seq))
+        conn.commit()
+        for scheduled_event_id, user_id, score in dataentries:
+            live_scoreboard.apply(scheduled_event_id, user_identity_map.player_for(user_id), int(score), 1)
+    # Row ids of a batch aren't known individually, so reload those users' score lists when needed
+    for scheduled_event_id, user_id, _ in dataentries:
+        user_score_index.invalidate(user_id, scheduled_event_id)
+        score_versions.bump(scheduled_event_id)
+    _refinalize(db, reopened)
+
+@instrumented
+def get_journal_checkpoint(db, journal) -> int:
+    """ Returns the last journal sequence number stored in the database (0 if none)
+    """
+    sql_getcheckpoint="SELECT last_seq FROM score_journal_checkpoint WHERE journal = %s"
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_getcheckpoint, [journal])
+        checkpoint = cursor.fetchone()
+    return checkpoint[0] if checkpoint else 0
 
+@instrumented
 def edit_score(db, dataentry) -> None:
     """ Executes sql query command to insert data to database
-        db = database connection object
+        db = database connection pool (or connection object)
         dataentry = [ newscore, id ] for modifying score, 
                     all integer values
-        delete = Optional bool to delete score
     """
-    cursor = db.cursor(dictionary=True)
     sql_updaterow="UPDATE event_result_points SET score = %s WHERE id = %s;" 
-    cursor.execute(sql_updaterow, dataentry)
-    
-    db.commit()
+    new_score, score_id = dataentry
+    known_score = user_score_index.lookup(score_id) # (user_id, scheduled_event_id, old score)
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_updaterow, dataentry)
+        conn.commit()
+        if known_score:
+            user_id, scheduled_event_id, old_score = known_score
+            live_scoreboard.apply(scheduled_event_id, user_identity_map.player_for(user_id),
+                                  int(new_score) - old_score, 0)
+        else:
+            live_scoreboard.invalidate()
+    if known_score:
+        score_versions.bump(known_score[1])
+    else:
+        score_versions.bump_all()
+    user_score_index.edit(score_id, new_score)
 
+@instrumented
 def delete_score(db, dataentry) -> None:
     """ Executes sql query command to insert data to database
-        db = database connection object
+        db = database connection pool (or connection object)
         dataentry = [ id ] for deleting score
                     all integer values
-        delete = Optional bool to delete score
     """
-    cursor = db.cursor(dictionary=True)
     sql_deleterow="DELETE FROM event_result_points WHERE id = %s;"
-    cursor.execute(sql_deleterow, dataentry)
+    known_score = user_score_index.lookup(dataentry[0]) # (user_id, scheduled_event_id, old score)
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_deleterow, dataentry)
+        conn.commit()
+        if known_score:
+            user_id, scheduled_event_id, old_score = known_score
+            live_scoreboard.apply(scheduled_event_id, user_identity_map.player_for(user_id), -old_score, -1)
+        else:
+            live_scoreboard.invalidate()
+    if known_score:
+        score_versions.bump(known_score[1])
+    else:
+        score_versions.bump_all()
+    user_score_index.delete(dataentry[0])
 
-    db.commit()
+def _format_user_scores(scores) -> list[dict[str,str]]:
+    """ [(score_id, score), ...] -> list of dicts as returned by get_user_scores """
+    if not scores:
+        return [{'score':"NO USER SCORES FOUND", 'id':'-999'}]
+    return [{'score': str(score), 'id': str(score_id)} for score_id, score in scores]
 
-def get_user_scores(db, user_name) -> list[dict[str,str]]:
-    """ Query the database for scores of active event of a given user
+@instrumented
+def get_user_scores(db, guild_id, user_name) -> list[dict[str,str]]:
+    """ Query the database for scores of the guild's active event of a given user
         Returns scoresmatch (list[str]) and idmatch (list[str])
+        (Each of the three lookups is served from memory when cached,
+        an unknown user and their scores are fetched with a single query)
     """
-    active_event =  check_for_active_event(db)
+    active_event =  check_for_active_event(db, guild_id)
     if (active_event['name'] == "NULL"):
         return [{'score':"NO CURRENT EVENT", 'id':'-999'}]
-    db_user_id = get_user_id(db, user_name)
-    
-    cursor = db.cursor(dictionary=True)
-    sql_getscores = """SELECT CAST(score AS CHAR) AS score, 
-                              CAST(id AS CHAR) AS id
-                       FROM event_result_points 
-                       WHERE user_id = %s AND scheduled_event_id = %s 
-                       ORDER BY id ASC;"""
-    cursor.execute(sql_getscores, (db_user_id, active_event['id']))
-    scoresdict = cursor.fetchall()  #[{'score': 667, 'id': 472}, ...]
-    
-    if not scoresdict:
-        return [{'score':"NO USER SCORES FOUND", 'id':'-999'}]
+    cached, user = user_identity_map.lookup(user_name)
+    if cached and user is None: # Unregistered users can't have scores
+        return _format_user_scores([])
+
+    if cached:
+        scores = user_score_index.get(user['id'], active_event['id'])
+        if scores is not None:
+            return _format_user_scores(scores)
+        sql_getscores = """SELECT id, score
+                           FROM event_result_points 
+                           WHERE user_id = %s AND scheduled_event_id = %s 
+                           ORDER BY id ASC;"""
+        with _connection(db) as conn, conn.cursor() as cursor:
+            cursor.execute(sql_getscores, (user['id'], active_event['id']))
+            scores = cursor.fetchall() # [(id, score), ...]
+    else:
+        # The user and their scores in one query, one row per score (or a single row with NULLs)
+        sql_getuserscores = """SELECT u.id, COALESCE(u.tag, u.discord_display_name, u.discord_user_id) AS player,
+                                      erp.id, erp.score
+                               FROM users u
+                               LEFT JOIN event_result_points erp
+                                      ON erp.user_id = u.id AND erp.scheduled_event_id = %s
+                               WHERE u.discord_user_id = %s
+                               ORDER BY erp.id ASC;"""
+        with _connection(db) as conn, conn.cursor() as cursor:
+            cursor.execute(sql_getuserscores, (active_event['id'], user_name))
+            rows = cursor.fetchall() # [(user id, player, score id, score), ...]
+        if not rows:
+            user_identity_map.put_missing(user_name)
+            return _format_user_scores([])
+        user = {'id': rows[0][0], 'player': rows[0][1]}
+        user_identity_map.put(user_name, user['id'], user['player'])
+        scores = [(score_id, score) for _, _, score_id, score in rows if score_id is not None]
+    user_score_index.load(user['id'], active_event['id'], scores)
 
-    return scoresdict
+    return _format_user_scores(scores)
 
-def get_latest_event(db, event_id=None):
-    """ Get most recent event, return a dict containing the unique id, 
+@instrumented
+def get_cached_user_scores(guild_id, user_name):
+    """ Same result as get_user_scores, but only using the in-memory caches.
+        Never touches the database: returns None when any piece isn't cached
+    """
+    cached, eventmatch = active_event_cache.peek(guild_id)
+    if not cached:
+        return None
+    if not eventmatch:
+        return [{'score':"NO CURRENT EVENT", 'id':'-999'}]
+    cached, user = user_identity_map.lookup(user_name)
+    if not cached:
+        return None
+    if user is None: # Known to be unregistered, so they can't have scores
+        return _format_user_scores([])
+    scores = user_score_index.get(user['id'], eventmatch['id'])
+    if scores is None:
+        return None
+    return _format_user_scores(scores)
+
+_SQL_EVENT_COLUMNS = """SELECT es.id, es.guild_id, e.name, es.utc_start_dt, es.utc_end_dt,
+                              snap.total_players AS snapshot_players
+                       FROM events_scheduled es
+                       JOIN events e ON e.id = es.event_id
+                       LEFT JOIN event_snapshots snap ON snap.scheduled_event_id = es.id"""
+
+# Latest started event of a guild (before a given time or now), newest first through the
+# (guild_id, utc_start_dt) index
+_SQL_LATEST_EVENT = {
+    'any':  _SQL_EVENT_COLUMNS + """
+            WHERE es.guild_id = %s AND es.utc_start_dt < COALESCE(%s, UTC_TIMESTAMP())
+            ORDER BY es.utc_start_dt DESC LIMIT 1;""",
+    'type': _SQL_EVENT_COLUMNS + """
+            WHERE es.guild_id = %s AND es.event_id = %s AND es.utc_start_dt < COALESCE(%s, UTC_TIMESTAMP())
+            ORDER BY es.utc_start_dt DESC LIMIT 1;""",
+}
+
+_SQL_SCHEDULED_EVENT = _SQL_EVENT_COLUMNS + " WHERE es.id = %s AND es.guild_id = %s;"
+
+@instrumented
+def get_latest_event(db, guild_id, event_id=None, before=None):
+    """ Get most recent event of a guild, return a dict containing the unique id, 
         name of event, and start date of the event
         OPTIONAL: event_id to find latest of a specific event
+                  before (datetime, UTC) to find the latest one that started before then
     """
-    cursor = db.cursor(dictionary=True)
-    sql_getevent="""SELECT es.id, e.name, es.utc_start_dt, es.utc_end_dt 
-                    FROM events_scheduled es
-                    JOIN events e ON e.id = es.event_id
-                    WHERE utc_start_dt =
-                        (SELECT MAX(utc_start_dt) FROM events_scheduled 
-                         WHERE utc_start_dt < UTC_TIMESTAMP())"""
-    if event_id is None:
-        cursor.execute(sql_getevent)
-    else:
-        sql_getevent = sql_getevent.replace("())", "() AND event_id = %s)")
-        cursor.execute(sql_getevent, [event_id])
-    
-    selectedevent = cursor.fetchone()
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        if event_id is None:
+            cursor.execute(_SQL_LATEST_EVENT['any'], [guild_id, before])
+        else:
+            cursor.execute(_SQL_LATEST_EVENT['type'], [guild_id, event_id, before])
+        
+        selectedevent = cursor.fetchone()
     
     return  selectedevent
 
-def get_event_scoreboard(db, event_type=None):
-    """ Query the FZD database for all scores of a given event,
-        defined by scheduled_event_id.
+@instrumented
+def get_scheduled_event(db, guild_id, scheduled_event_id):
+    """ Returns the eventinfo (same dict as get_latest_event) of one scheduled event
+        of the guild, or None
+    """
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(_SQL_SCHEDULED_EVENT, [scheduled_event_id, guild_id])
+        return cursor.fetchone()
 
-        Returns an ordered list of dicts with 'player': str and 'score': Decimal 
-        as well as the eventinfo (from get_latest_event function)
+@instrumented
+def get_recent_events(db, guild_id, event_type=None, limit=25):
+    """ Most recent finished events of a guild (newest first), optionally of one type.
+        Returns a list of dicts with 'id' (scheduled event id), 'name' and 'utc_start_dt'
+    """
+    sql_getevents = {
+        'any':  """SELECT es.id, e.name, es.utc_start_dt FROM events_scheduled es
+                   JOIN events e ON e.id = es.event_id
+                   WHERE es.guild_id = %s AND es.utc_end_dt < UTC_TIMESTAMP()
+                   ORDER BY es.utc_start_dt DESC LIMIT %s;""",
+        'type': """SELECT es.id, e.name, es.utc_start_dt FROM events_scheduled es
+                   JOIN events e ON e.id = es.event_id
+                   WHERE es.guild_id = %s AND es.event_id = %s AND es.utc_end_dt < UTC_TIMESTAMP()
+                   ORDER BY es.utc_start_dt DESC LIMIT %s;""",
+    }
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        if event_type is None:
+            cursor.execute(sql_getevents['any'], [guild_id, limit])
+        else:
+            cursor.execute(sql_getevents['type'], [guild_id, event_type, limit])
+        return cursor.fetchall()
+
+def _latest_event_from_cache(guild_id, event_type=None):
+    """ While an event is running it is also the guild's latest started one, so
+        get_latest_event() can be answered from active_event_cache.
+        Returns None when that isn't possible
+    """
+    cached, eventmatch = active_event_cache.peek(guild_id)
+    if not cached or not eventmatch:
+        return None
+    if event_type is not None and eventmatch['event_id'] != event_type:
+        return None
+    eventinfo = {key: eventmatch[key] for key in ('id', 'name', 'utc_start_dt', 'utc_end_dt')}
+    eventinfo['guild_id'] = guild_id
+    return eventinfo
+
+@instrumented
+def get_scoreboard_event(db, guild_id, event_type=None, before=None, scheduled_event_id=None):
+    """ Returns the eventinfo of the scoreboard /show displays: the guild's latest
+        started event (of type event_type if given, started before `before`
+        if given), or one specific scheduled event. None if there isn't one
     """
+    if scheduled_event_id is not None:
+        return get_scheduled_event(db, guild_id, scheduled_event_id)
+    eventinfo = _latest_event_from_cache(guild_id, event_type) if before is None else None
+    if eventinfo is None:
+        if event_type is None:
+            eventinfo=get_latest_event(db, guild_id, before=before)
+        else:
+            eventinfo=get_latest_event(db, guild_id, event_id=event_type, before=before)
+    return eventinfo
 
+# Players with the same score are ordered by code point, like the str order of the live
+# scoreboard (scoreboard.py), instead of MySQL's case-insensitive default collation.
+# CONVERT first: COLLATE utf8mb4_bin is refused on latin1 columns (MariaDB's default)
+_PLAYER = "CONVERT(COALESCE(u.tag, u.discord_display_name, u.discord_user_id) USING utf8mb4) COLLATE utf8mb4_bin"
+_SNAPSHOT_PLAYER = "CONVERT(player USING utf8mb4) COLLATE utf8mb4_bin"
+
+@instrumented
+def get_scoreboard_rows(db, eventinfo):
+    """ Returns the ordered list of dicts with 'player': str and 'score': Decimal
+        of the event described by eventinfo
+        (For the live event they come from memory, see scoreboard.py)
+    """
     sql_getscoreboard=(
-    """SELECT COALESCE(u.tag, u.discord_display_name, u.discord_user_id) AS player, 
-       SUM(erp.score) AS score 
+    f"""SELECT {_PLAYER} AS player, 
+       SUM(erp.score) AS score,
+       COUNT(*) AS num_scores
        FROM  
          event_result_points erp 
        JOIN 
          users u ON u.id = erp.user_id 
        WHERE scheduled_event_id = %s 
        GROUP BY player 
-       ORDER BY score DESC;"""
+       ORDER BY score DESC, player ASC;"""
     )
-    if event_type is None:
-        eventinfo=get_latest_event(db)
+    allscores = live_scoreboard.rows(eventinfo['id'])
+    if allscores is not None:
+        return allscores
+    if eventinfo.get('snapshot_players') is not None: # Finished event, read its frozen standings
+        with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+            cursor.execute(_SQL_SNAPSHOT_PAGE['all'], [eventinfo['id']])
+            return cursor.fetchall()
+   
+    rebuild_token = live_scoreboard.begin_rebuild()
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_getscoreboard, [eventinfo['id']]) 
+        allscores = cursor.fetchall() #[{'player': 'Angelo', 'score': Decimal('1140')}...]
+
+    # Only running events get materialized, older ones can't change anymore
+    if active_event_cache.is_active(eventinfo['id']):
+        live_scoreboard.finish_rebuild(rebuild_token, eventinfo['id'], allscores)
+ 
+    return allscores
+
+# Ranked standings of one event. RANK() runs over the whole event before the keyset
+# filter, so ranks (including ties) stay correct across page boundaries
+_SQL_RANKED_STANDINGS = f"""
+    SELECT player, score, player_rank, total_players FROM (
+        SELECT player, score,
+               RANK() OVER (ORDER BY score DESC) AS player_rank,
+               COUNT(*) OVER () AS total_players
+        FROM (SELECT {_PLAYER} AS player,
+                     SUM(erp.score) AS score
+              FROM event_result_points erp
+              JOIN users u ON u.id = erp.user_id
+              WHERE erp.scheduled_event_id = %s
+              GROUP BY player) totals
+    ) ranked"""
+
+_SQL_SCOREBOARD_PAGE = {
+    'first':  _SQL_RANKED_STANDINGS + """
+              ORDER BY score DESC, player ASC LIMIT %s;""",
+    'after':  _SQL_RANKED_STANDINGS + """
+              WHERE score < %s OR (score = %s AND player > %s)
+              ORDER BY score DESC, player ASC LIMIT %s;""",
+    'before': _SQL_RANKED_STANDINGS + """
+              WHERE score > %s OR (score = %s AND player < %s)
+              ORDER BY score ASC, player DESC LIMIT %s;""",
+}
+
+# Same pages, read from the frozen standings of a finalized event (primary key range)
+_SQL_SNAPSHOT_PAGE = {
+    'all':    f"""SELECT player, score, player_rank FROM event_standings
+                  WHERE scheduled_event_id = %s
+                  ORDER BY player_rank ASC, {_SNAPSHOT_PLAYER} ASC;""",
+    'first':  f"""SELECT player, score, player_rank FROM event_standings
+                  WHERE scheduled_event_id = %s
+                  ORDER BY player_rank ASC, {_SNAPSHOT_PLAYER} ASC LIMIT %s;""",
+    'after':  f"""SELECT player, score, player_rank FROM event_standings
+                  WHERE scheduled_event_id = %s AND (score < %s OR (score = %s AND {_SNAPSHOT_PLAYER} > %s))
+                  ORDER BY player_rank ASC, {_SNAPSHOT_PLAYER} ASC LIMIT %s;""",
+    'before': f"""SELECT player, score, player_rank FROM event_standings
+                  WHERE scheduled_event_id = %s AND (score > %s OR (score = %s AND {_SNAPSHOT_PLAYER} < %s))
+                  ORDER BY player_rank DESC, {_SNAPSHOT_PLAYER} DESC LIMIT %s;""",
+}
+
+@instrumented
+def get_scoreboard_page(db, eventinfo, page_size=10, after=None, before=None):
+    """ One page of the scoreboard of the event described by eventinfo, fetched
+        with a keyset query on (score, player) instead of the whole scoreboard.
+        after / before = (score, player) of the last / first row of the page
+                         currently shown, to get the next / previous page
+        Returns (rows, total number of players), rows being dicts with
+        'rank': int, 'player': str and 'score': int
+    """
+    page = live_scoreboard.page(eventinfo['id'], page_size, after=after, before=before)
+    if page is None:
+        if active_event_cache.is_active(eventinfo['id']):
+            get_scoreboard_rows(db, eventinfo) # Materializes the live event, then page from memory
+            page = live_scoreboard.page(eventinfo['id'], page_size, after=after, before=before)
+    if page is not None:
+        return page
+
+    # Finished events are read from their snapshot, others are ranked from the raw points
+    snapshot = eventinfo.get('snapshot_players') is not None
+    statements = _SQL_SNAPSHOT_PAGE if snapshot else _SQL_SCOREBOARD_PAGE
+    if after is not None:
+        sql_getpage, params = statements['after'], (eventinfo['id'], after[0], after[0], after[1], page_size)
+    elif before is not None:
+        sql_getpage, params = statements['before'], (eventinfo['id'], before[0], before[0], before[1], page_size)
+    else:
+        sql_getpage, params = statements['first'], (eventinfo['id'], page_size)
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_getpage, params)
+        fetched = cursor.fetchall() # [(player, score, player_rank[, total_players]), ...]
+    if before is not None:
+        fetched.reverse()
+
+    rows = [{'rank': int(row[2]), 'player': row[0], 'score': int(row[1])} for row in fetched]
+    if snapshot:
+        total = eventinfo['snapshot_players']
     else:
-        eventinfo=get_latest_event(db,event_id=event_type)
-    cursor = db.cursor(dictionary=True)
+        total = int(fetched[0][3]) if fetched else 0
+    return rows, total
+
+@instrumented
+def finalize_event(db, scheduled_event_id) -> int:
+    """ Stores the ranked standings of a finished event in event_standings, so
+        /show never has to re-aggregate its raw points again. Re-running it
+        replaces the snapshot. Returns the number of players
+    """
+    sql_clearstandings = "DELETE FROM event_standings WHERE scheduled_event_id = %s;"
+    sql_savestandings = ("""INSERT INTO event_standings (scheduled_event_id, player_rank, player, score)
+                            SELECT %s, player_rank, player, score FROM (""" + _SQL_RANKED_STANDINGS + ") standings;")
+    sql_savesnapshot = """INSERT INTO event_snapshots (scheduled_event_id, total_players, finalized_at)
+                          VALUES (%s, %s, UTC_TIMESTAMP())
+                          ON DUPLICATE KEY UPDATE total_players = %s, finalized_at = UTC_TIMESTAMP();"""
+    with _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(sql_clearstandings, [scheduled_event_id])
+        cursor.execute(sql_savestandings, (scheduled_event_id, scheduled_event_id))
+        total_players = cursor.rowcount
+        cursor.execute(sql_savesnapshot, (scheduled_event_id, total_players, total_players))
+        conn.commit()
+    return total_players
+
+@instrumented
+def finalize_ended_events(db, grace_minutes=10) -> int:
+    """ Snapshots every event that ended more than grace_minutes ago and has
+        no snapshot yet (late write-behind flushes land within the grace period),
+        including snapshots dropped by later scores that weren't rebuilt yet.
+        Returns how many events were finalized
+    """
+    sql_getended = """SELECT es.id FROM events_scheduled es
+                      LEFT JOIN event_snapshots snap ON snap.scheduled_event_id = es.id
+                      WHERE es.utc_end_dt < UTC_TIMESTAMP() - INTERVAL %s MINUTE
+                        AND snap.scheduled_event_id IS NULL
+                      ORDER BY es.utc_start_dt ASC;"""
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_getended, [grace_minutes])
+        ended = [row[0] for row in cursor.fetchall()]
+    for scheduled_event_id in ended:
+        total_players = finalize_event(db, scheduled_event_id)
+        print(f"Finalized scoreboard snapshot of scheduled event {scheduled_event_id} ({total_players} players)")
+    return len(ended)
+
+# score_versions key of a guild's player stats is (STATS_VERSION_KEY, guild_id), bumped whenever
+# they change (render cache of /standings)
+STATS_VERSION_KEY = 'player_stats'
+
+@instrumented
+def update_player_stats(db, batch_size=50) -> int:
+    """ Adds finalized events that aren't counted yet to player_stats, batch_size
+        events per transaction: right after an event is finalized that is just that
+        one, the first time it is the whole history (backfill).
+        Returns how many events were added
+    """
+    # Finalized events not rolled up yet, oldest first
+    sql_getpending = """SELECT snap.scheduled_event_id, es.guild_id, es.event_id
+                        FROM event_snapshots snap
+                        JOIN events_scheduled es ON es.id = snap.scheduled_event_id
+                        LEFT JOIN stats_events se ON se.scheduled_event_id = snap.scheduled_event_id
+                        WHERE se.scheduled_event_id IS NULL
+                        ORDER BY snap.scheduled_event_id ASC LIMIT %s;"""
+    # Raw scores of the pending events between two scheduled event ids
+    sql_getresults = """SELECT erp.scheduled_event_id, es.event_id, erp.user_id, erp.score, es.guild_id
+                        FROM event_result_points erp
+                        JOIN events_scheduled es ON es.id = erp.scheduled_event_id
+                        JOIN event_snapshots snap ON snap.scheduled_event_id = erp.scheduled_event_id
+                        LEFT JOIN stats_events se ON se.scheduled_event_id = erp.scheduled_event_id
+                        WHERE erp.scheduled_event_id BETWEEN %s AND %s AND se.scheduled_event_id IS NULL;"""
+    sql_gettypestats = ("SELECT " + ", ".join(stats.ROLLUP_COLUMNS)
+                        + " FROM player_stats WHERE guild_id = %s AND event_id = %s;")
+    sql_cleartypestats = "DELETE FROM player_stats WHERE guild_id = %s AND event_id = %s;"
+    sql_savestats = ("INSERT INTO player_stats (guild_id, " + ", ".join(stats.ROLLUP_COLUMNS) + ") VALUES ("
+                     + ", ".join(["%s"] * (len(stats.ROLLUP_COLUMNS) + 1)) + ");")
+    sql_markevents = "INSERT INTO stats_events (scheduled_event_id, guild_id, event_id) VALUES (%s, %s, %s);"
+
+    added = 0
+    guilds = set()
+    while True:
+        with _connection(db) as conn, conn.cursor() as cursor:
+            cursor.execute(sql_getpending, [batch_size])
+            pending = cursor.fetchall() # [(scheduled_event_id, guild_id, event_id), ...]
+            if not pending:
+                break
+            cursor.execute(sql_getresults, (pending[0][0], pending[-1][0]))
+            results = cursor.fetchall() # [(scheduled_event_id, event_id, user_id, score, guild_id), ...]
+
+            # Per guild: stored stats of each event type involved + the new events, written back in one go
+            for guild_id in sorted({guild_id for _, guild_id, _ in pending}):
+                new_stats = stats.rollup([row[:4] for row in results if row[4] == guild_id])
+                for event_type in sorted({event_type for _, g, event_type in pending if g == guild_id}):
+                    cursor.execute(sql_gettypestats, (guild_id, event_type))
+                    merged = stats.merge(cursor.fetchall(), new_stats[new_stats[:, 0] == event_type])
+                    cursor.execute(sql_cleartypestats, (guild_id, event_type))
+                    if len(merged):
+                        cursor.executemany(sql_savestats, [(guild_id,) + row for row in stats.to_rows(merged)])
+                guilds.add(guild_id)
+            cursor.executemany(sql_markevents, pending)
+            conn.commit()
+        added += len(pending)
+    for guild_id in guilds:
+        score_versions.bump((STATS_VERSION_KEY, guild_id))
+    if added:
+        print(f"Added {added} finished events to player stats")
+    return added
+
+@instrumented
+def get_standings(db, guild_id, event_type, limit=20):
+    """ Season standings of one event type in a guild from player_stats, best total first.
+        Returns (rows, number of events held), rows being dicts with 'rank', 'player',
+        'events_played', 'total_score', 'average', 'best_finish', 'wins' and 'podiums'
+    """
+    sql_getstandings = """SELECT COALESCE(u.tag, u.discord_display_name, u.discord_user_id) AS player,
+                                 ps.events_played, ps.total_score, ps.best_finish, ps.wins, ps.podiums
+                          FROM player_stats ps
+                          JOIN users u ON u.id = ps.user_id
+                          WHERE ps.guild_id = %s AND ps.event_id = %s
+                          ORDER BY ps.total_score DESC, player ASC LIMIT %s;"""
+    sql_geteventsheld = "SELECT COUNT(*) FROM stats_events WHERE guild_id = %s AND event_id = %s;"
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_getstandings, (guild_id, event_type, limit))
+        fetched = cursor.fetchall()
+        cursor.execute(sql_geteventsheld, (guild_id, event_type))
+        events_held = cursor.fetchone()[0]
+
+    rows = []
+    for i, (player, played, total, best_finish, wins, podiums) in enumerate(fetched):
+        rank = rows[-1]['rank'] if rows and rows[-1]['total_score'] == total else i + 1
+        rows.append({'rank': rank, 'player': player, 'events_played': int(played), 'total_score': int(total),
+                     'average': int(total) / int(played), 'best_finish': int(best_finish),
+                     'wins': int(wins), 'podiums': int(podiums)})
+    return rows, int(events_held)
+
+@instrumented
+def get_player_stats(db, guild_id, discord_id):
+    """ Statistics of one player in a guild per event type from player_stats, most played first.
+        Returns a list of dicts with 'name' (event type), 'events_played', 'events_held',
+        'total_score', 'average', 'best_score', 'best_finish', 'wins' and 'podiums'
+    """
+    sql_getplayerstats = """SELECT e.name, ps.events_played, ps.total_score, ps.best_score,
+                                   ps.best_finish, ps.wins, ps.podiums,
+                                   (SELECT COUNT(*) FROM stats_events se
+                                    WHERE se.guild_id = ps.guild_id AND se.event_id = ps.event_id) AS events_held
+                            FROM player_stats ps
+                            JOIN users u ON u.id = ps.user_id
+                            JOIN events e ON e.id = ps.event_id
+                            WHERE ps.guild_id = %s AND u.discord_user_id = %s
+                            ORDER BY ps.events_played DESC, e.name ASC;"""
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_getplayerstats, (guild_id, discord_id))
+        fetched = cursor.fetchall()
+    return [{'name': name, 'events_played': int(played), 'events_held': int(held), 'total_score': int(total),
+             'average': int(total) / int(played), 'best_score': int(best_score), 'best_finish': int(best_finish),
+             'wins': int(wins), 'podiums': int(podiums)}
+            for name, played, total, best_score, best_finish, wins, podiums, held in fetched]
+
+@instrumented
+def get_event_scoreboard(db, guild_id, event_type=None):
+    """ Query the FZD database for all scores of the guild's latest event
+        (of type event_type if given).
+
+        Returns an ordered list of dicts with 'player': str and 'score': Decimal 
+        as well as the eventinfo (from get_latest_event function)
+    """
+    eventinfo = get_scoreboard_event(db, guild_id, event_type)
 
     # Check there's an event to display
     if not eventinfo:
         return None, None
-   
-    cursor.execute(sql_getscoreboard, [eventinfo['id']]) 
-    allscores = cursor.fetchall() #[{'player': 'Angelo', 'score': Decimal('1140')}...]
- 
-    return eventinfo, allscores
 
+    return eventinfo, get_scoreboard_rows(db, eventinfo)
+
+@instrumented
+def load_live_scoreboard(db, guild_ids) -> None:
+    """ (Re)builds the in-memory scoreboards of the running events of the guilds, from the database
+    """
+    live_scoreboard.invalidate()
+    for guild_id in guild_ids:
+        if check_for_active_event(db, guild_id)['name'] != "NULL":
+            get_event_scoreboard(db, guild_id)
+
+# Users looked up per query by import_scores. The name list is padded to this size
+# so every chunk runs the same statement
+_IMPORT_LOOKUP_CHUNK = 500
+
+def _lookup_players(cursor, names) -> dict:
+    """ casefolded name -> [{'id', 'discord_user_id', 'player'}, ...] of the users whose
+        discord username or tag is one of names (both columns are looked up in one query)
+    """
+    placeholders = ", ".join(["%s"] * _IMPORT_LOOKUP_CHUNK)
+    sql_getplayers = f"""SELECT id, discord_user_id, tag,
+                                COALESCE(tag, discord_display_name, discord_user_id) AS player
+                         FROM users WHERE discord_user_id IN ({placeholders}) OR tag IN ({placeholders});"""
+    found = {}
+    for start in range(0, len(names), _IMPORT_LOOKUP_CHUNK):
+        chunk = names[start:start + _IMPORT_LOOKUP_CHUNK]
+        chunk = chunk + [chunk[-1]] * (_IMPORT_LOOKUP_CHUNK - len(chunk))
+        cursor.execute(sql_getplayers, chunk + chunk)
+        for user in cursor.fetchall():
+            found[user['id']] = user
+    by_name = {}
+    # Exact discord usernames win over tags (a tag can be someone else's username)
+    for user in found.values():
+        by_name.setdefault(('id', user['discord_user_id'].casefold()), []).append(user)
+        if user['tag']:
+            by_name.setdefault(('tag', user['tag'].casefold()), []).append(user)
+    return by_name
+
+@instrumented
+def import_scores(db, guild_id, scheduled_event_id, rows) -> dict:
+    """ Bulk insert of [(player, score), ...] into a scheduled event of the guild (/import_scores):
+        players are resolved with batched lookups, the scores inserted with one
+        executemany, all in one transaction. Players that aren't registered, or whose
+        tag matches several users, are skipped and reported.
+        If the event was already finalized its snapshot and the player stats of its
+        event type are dropped in the same transaction and rebuilt afterwards.
+        Returns {'imported': int, 'unknown': [player, ...], 'ambiguous': [player, ...]}
+    """
+    summary = {'imported': 0, 'unknown': [], 'ambiguous': []}
+    names = sorted({player for player, _ in rows})
+    if not names:
+        return summary
+
+    with live_scoreboard.change(), _connection(db) as conn, conn.cursor(dictionary=True) as cursor:
+        cursor.execute(_SQL_SCHEDULED_EVENT, [scheduled_event_id, guild_id])
+        eventinfo = cursor.fetchone()
+        if eventinfo is None:
+            raise ValueError(f"scheduled event {scheduled_event_id} doesn't exist")
+        by_name = _lookup_players(cursor, names)
+
+        dataentries = []
+        resolved = {} # user id -> user
+        for player, score in rows:
+            matches = by_name.get(('id', player.casefold())) or by_name.get(('tag', player.casefold()), [])
+            if len(matches) == 1:
+                resolved[matches[0]['id']] = matches[0]
+                dataentries.append((scheduled_event_id, matches[0]['id'], score))
+            elif not matches and player not in summary['unknown']:
+                summary['unknown'].append(player)
+            elif len(matches) > 1 and player not in summary['ambiguous']:
+                summary['ambiguous'].append(player)
+
+        reopened = []
+        if dataentries:
+            cursor.executemany(_SQL_NEW_SCORE, dataentries)
+            reopened = _reopen_finalized(cursor, [scheduled_event_id])
+        conn.commit()
+        for _, user_id, score in dataentries:
+            live_scoreboard.apply(scheduled_event_id, resolved[user_id]['player'], int(score), 1)
+
+    summary['imported'] = len(dataentries)
+    if not dataentries:
+        return summary
+    for user in resolved.values():
+        user_identity_map.put(user['discord_user_id'], user['id'], user['player'])
+        user_score_index.invalidate(user['id'], scheduled_event_id)
+    score_versions.bump(scheduled_event_id)
+    _refinalize(db, reopened)
+    return summary
+
+# Rows of export_event_csv, oldest score first / best total first
+_SQL_EXPORT = {
+    'points':    """SELECT erp.id AS score_id, u.discord_user_id,
+                           COALESCE(u.tag, u.discord_display_name, u.discord_user_id) AS player, erp.score
+                    FROM event_result_points erp
+                    JOIN users u ON u.id = erp.user_id
+                    WHERE erp.scheduled_event_id = %s
+                    ORDER BY erp.id ASC;""",
+    'standings': _SQL_RANKED_STANDINGS + """
+                    ORDER BY score DESC, player ASC;""",
+}
+
+@instrumented
+def export_event_csv(db, guild_id, scheduled_event_id, kind, out) -> int:
+    """ Writes the raw points ('points') or the ranked standings ('standings') of a
+        scheduled event of the guild as CSV to the text file out. Rows are streamed
+        from an unbuffered cursor straight into the file, never all held in memory.
+        Returns the number of rows written (0 if the event isn't one of the guild's)
+    """
+    sql_checkguild = "SELECT id FROM events_scheduled WHERE id = %s AND guild_id = %s;"
+    with _connection(db) as conn, conn.cursor() as cursor:
+        cursor.execute(sql_checkguild, (scheduled_event_id, guild_id))
+        if cursor.fetchone() is None:
+            return 0
+    writer = csv.writer(out)
+    written = 0
+    with _connection(db) as conn, conn.cursor(buffered=False) as cursor:
+        cursor.execute(_SQL_EXPORT[kind], [scheduled_event_id])
+        writer.writerow(cursor.column_names)
+        for row in cursor:
+            writer.writerow(row)
+            written += 1
+    return written
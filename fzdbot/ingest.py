@@ -0,0 +1,247 @@
+""" Optional write-behind ingestion of /add_score submissions
+
+    Enabled with SCORE_WRITE_BEHIND=1. A submitted score is appended to a
+    local append-only journal (one JSON line per score, fsynced) and
+    acknowledged right away. A background thread flushes the pending scores
+    to event_result_points in batches (one executemany, one transaction)
+    once SCORE_BATCH_SIZE scores are waiting or every SCORE_FLUSH_INTERVAL
+    seconds. Whatever wasn't flushed when the bot stopped is replayed from
+    the journal on the next start.
+
+    Scores the database refuses (e.g. their scheduled event was deleted
+    meanwhile) would fail every batch they are in forever. When a batch
+    fails like that its scores are inserted one by one and the refused ones
+    are moved to <journal>.rejected, so the rest of the queue keeps going.
+    Connection errors leave the batch queued for the next flush
+"""
+import os
+import json
+import sqlite3
+import threading
+
+import mysql.connector
+
+from fzdbot.fzd_db import submit_score_batch
+from fzdbot.fzd_db import get_journal_checkpoint
+
+# Errors caused by the scores themselves, retrying the same scores can't help
+_REJECTED_ERRORS = (mysql.connector.IntegrityError, mysql.connector.DataError,
+                    sqlite3.IntegrityError, sqlite3.DataError)
+
+
+class ScoreIngestor:
+    """ Journal + batching in front of submit_score_batch()
+
+        db: database connection pool
+        journal_path: file the pending scores are appended to
+        batch_size: pending scores that trigger a flush right away
+        flush_interval: max seconds a score waits before being flushed
+        fsync: fsync the journal after every append (durable across power loss)
+    """
+    def __init__(self, db, journal_path: str, batch_size: int = 50,
+                 flush_interval: float = 2.0, fsync: bool = True):
+        self.db = db
+        self.journal_path = os.path.abspath(journal_path)
+        self.rejected_path = self.journal_path + ".rejected"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._lock = threading.Lock()       # pending list + journal file
+        self._flush_lock = threading.Lock() # one flush at a time
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pending = [] # [(seq, [scheduled_event_id, user_id, score]), ...]
+        self._seq = 0
+        self._journal = None
+        self.started = False
+        self.flushed = 0
+        self.flush_failures = 0
+        self.rejected = 0
+
+    # ----- journal -----
+
+    def _read_journal(self) -> list:
+        entries = []
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    entries.append((row['seq'], [row['scheduled_event_id'], row['user_id'], row['score']]))
+                except (ValueError, KeyError):
+                    # Torn last line of a crash mid-write, that score was never acknowledged
+                    continue
+        return entries
+
+    def _append(self, entries) -> None:
+        for seq, (scheduled_event_id, user_id, score) in entries:
+            self._journal.write(json.dumps({'seq': seq, 'scheduled_event_id': scheduled_event_id,
+                                            'user_id': user_id, 'score': score}) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self) -> None:
+        """ Compacts the journal down to the still pending entries (atomic replace) """
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self.journal_path + ".tmp"
+        self._journal = open(tmp_path, "w", encoding="utf-8")
+        self._append(self._pending)
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    # ----- public API -----
+
+    def start(self) -> None:
+        """ Replays the journal (skipping what the database already has) and
+            starts the background flusher thread. Needs the database (checkpoint),
+            so it runs with the startup jobs once the database is ready; until then
+            `started` is False and scores must be inserted directly
+        """
+        last_seq = get_journal_checkpoint(self.db, self.journal_path)
+        entries = self._read_journal()
+        with self._lock:
+            self._pending = [(seq, entry) for seq, entry in entries if seq > last_seq]
+            self._seq = max([last_seq] + [seq for seq, _ in entries])
+            self._rewrite_journal()
+        if self._pending:
+            print(f"Replaying {len(self._pending)} unflushed scores from {self.journal_path}")
+            try:
+                self.flush()
+            except Exception as err:
+                print(f"❌ Replaying queued scores failed ({err}), the flusher thread retries")
+
+        self._thread = threading.Thread(target=self._run, name="score_ingestor", daemon=True)
+        self._thread.start()
+        self.started = True
+        print(f"✅ Write-behind score ingestion enabled (journal {self.journal_path})")
+
+    def submit(self, dataentry) -> None:
+        """ Durably queues a score, dataentry = [ scheduled_event_id, user_id, score ]
+        """
+        with self._lock:
+            self._seq += 1
+            entry = (self._seq, list(dataentry))
+            self._append([entry])
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        """ Counters for the metrics gauges. Called on the event loop, so it doesn't take
+            _lock (held across journal fsyncs and rewrites): each value is read atomically,
+            they may just be from slightly different moments
+        """
+        return {
+            'pending': len(self._pending),
+            'flushed': self.flushed,
+            'flush_failures': self.flush_failures,
+            'rejected': self.rejected,
+        }
+
+    def flush(self) -> int:
+        """ Writes every pending score to the database now, returns how many were written.
+            Call before reading the scoreboard so it includes queued scores.
+            Raises if the database can't be reached (the scores stay queued)
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            try:
+                submit_score_batch(self.db, [entry for _, entry in batch],
+                                   journal=self.journal_path, last_seq=batch[-1][0])
+                self._done(batch, [])
+                return len(batch)
+            except _REJECTED_ERRORS as err:
+                print(f"⚠️  A batch of {len(batch)} queued scores was refused ({err}), inserting them one by one")
+                return self._flush_one_by_one(batch)
+            except Exception:
+                with self._lock:
+                    self.flush_failures += 1
+                raise
+
+    def _flush_one_by_one(self, batch) -> int:
+        """ Inserts the scores of a refused batch separately, setting aside the ones refused again """
+        written, rejected = [], []
+        try:
+            for seq, entry in batch:
+                try:
+                    submit_score_batch(self.db, [entry], journal=self.journal_path, last_seq=seq)
+                    written.append((seq, entry))
+                except _REJECTED_ERRORS as err:
+                    rejected.append((seq, entry, str(err)))
+        except Exception:
+            with self._lock:
+                self.flush_failures += 1
+            raise
+        finally:
+            self._done(written, rejected)
+        return len(written)
+
+    def _done(self, written, rejected) -> None:
+        """ Drops written and rejected scores from the queue and the journal, rejected ones
+            are appended to the rejected file (same format, plus the error) for a mod to look at
+        """
+        if rejected:
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                for seq, (scheduled_event_id, user_id, score), error in rejected:
+                    f.write(json.dumps({'seq': seq, 'scheduled_event_id': scheduled_event_id,
+                                        'user_id': user_id, 'score': score, 'error': error}) + "\n")
+            print(f"❌ {len(rejected)} queued scores were refused by the database, moved to {self.rejected_path}")
+        handled = {seq for seq, _ in written} | {seq for seq, _, _ in rejected}
+        if not handled:
+            return
+        with self._lock:
+            self._pending = [(seq, entry) for seq, entry in self._pending if seq not in handled]
+            self._rewrite_journal()
+            self.flushed += len(written)
+            self.rejected += len(rejected)
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as err:
+                # Scores stay in the journal and pending list, next round retries
+                print(f"❌ Flushing queued scores failed: {err}")
+
+    def stop(self) -> None:
+        """ Stops the flusher thread after a last flush """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+def create_score_ingestor(db):
+    """ Returns a ScoreIngestor if SCORE_WRITE_BEHIND is enabled in .env, else None.
+        It isn't started yet, see ScoreIngestor.start()
+    """
+    if os.getenv("SCORE_WRITE_BEHIND", "0").lower() not in ("1", "true", "yes"):
+        return None
+    ingestor = ScoreIngestor(
+        db,
+        journal_path=os.getenv("SCORE_JOURNAL_PATH", "score_journal.jsonl"),
+        batch_size=int(os.getenv("SCORE_BATCH_SIZE", 50)),
+        flush_interval=float(os.getenv("SCORE_FLUSH_INTERVAL", 2.0)),
+        fsync=os.getenv("SCORE_JOURNAL_FSYNC", "1").lower() in ("1", "true", "yes"),
+    )
+    return ingestor
@@ -0,0 +1,317 @@
+""" Lightweight instrumentation of database calls and slash commands
+
+    Every fzd_db function decorated with @instrumented and every command
+    decorated with @timed_command records its latency in a fixed-bucket
+    histogram, plus call and error counts. Queries run through an
+    instrumented connection (see fzd_db._connection) are timed too, rows
+    fetched are counted per fzd_db function, and queries slower than
+    SLOW_QUERY_MS are kept with their SQL text. Responses deferred because
+    their work ran past the response budget are counted per command (see
+    responses.py). Recording is a couple of
+    perf_counter() calls and a short lock, so it stays on in production.
+    The numbers are shown by /bot_stats and can be written periodically as
+    a Prometheus text file (METRICS_FILE)
+"""
+import os
+import time
+import threading
+import functools
+import contextvars
+from bisect import bisect_left
+from collections import deque
+
+# Histogram bucket upper bounds, in seconds (Prometheus "le" labels)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# kind -> (Prometheus metric name, label name, help text)
+_KINDS = {
+    'db':      ("fzdbot_db_call_seconds", "function", "Latency of fzd_db function calls"),
+    'query':   ("fzdbot_db_query_seconds", "function", "Latency of the SQL statements run by each fzd_db function"),
+    'command': ("fzdbot_command_seconds", "command", "Latency of slash command and autocomplete handlers"),
+}
+
+
+class Histogram:
+    """ Call count, error count, total time and bucketed latencies of one function
+    """
+    __slots__ = ('counts', 'count', 'sum', 'max', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, failed: bool = False) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if failed:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-th quantile (max for the +Inf bucket)
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            cumulative += n
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """ Registry of histograms by (kind, name), rows fetched by fzd_db function
+        and the most recent slow queries
+    """
+    def __init__(self, slow_query_seconds: float = 0.2, slow_query_log: int = 20):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self._histograms = {} # (kind, name) -> Histogram
+        self._rows = {}       # fzd_db function name -> rows fetched
+        self._coalesced = {}  # fzd_db function name -> calls served by another caller's query (async_db)
+        self._deferred = {}   # command name -> responses deferred because the work was too slow (responses.py)
+        self.slow_queries = deque(maxlen=slow_query_log) # (when, function, seconds, sql)
+        self.slow_query_count = 0
+        self.started = time.time()
+
+    def observe(self, kind: str, name: str, seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = Histogram()
+            histogram.observe(seconds, failed)
+
+    def add_rows(self, name: str, rows: int) -> None:
+        with self._lock:
+            self._rows[name] = self._rows.get(name, 0) + rows
+
+    def add_coalesced(self, name: str) -> None:
+        with self._lock:
+            self._coalesced[name] = self._coalesced.get(name, 0) + 1
+
+    def coalesced(self) -> dict:
+        with self._lock:
+            return dict(self._coalesced)
+
+    def add_deferred(self, name: str) -> None:
+        with self._lock:
+            self._deferred[name] = self._deferred.get(name, 0) + 1
+
+    def deferred(self) -> dict:
+        with self._lock:
+            return dict(self._deferred)
+
+    def observe_query(self, name: str, sql: str, seconds: float, failed: bool = False) -> None:
+        self.observe('query', name, seconds, failed)
+        if seconds >= self.slow_query_seconds:
+            with self._lock:
+                self.slow_query_count += 1
+                self.slow_queries.append((time.time(), name, seconds, " ".join(sql.split())))
+            print(f"🐢 Slow query in {name} ({seconds * 1000:.0f} ms): {' '.join(sql.split())[:200]}")
+
+    def snapshot(self, kind: str) -> list[dict]:
+        """ Summary of every histogram of one kind, slowest total time first:
+            [{'name', 'calls', 'errors', 'total_ms', 'avg_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'rows'}, ...]
+        """
+        with self._lock:
+            items = [(name, histogram) for (k, name), histogram in self._histograms.items() if k == kind]
+            summary = [{'name': name,
+                        'calls': h.count,
+                        'errors': h.errors,
+                        'total_ms': h.sum * 1000,
+                        'avg_ms': h.sum * 1000 / h.count if h.count else 0.0,
+                        'p50_ms': h.quantile(0.50) * 1000,
+                        'p95_ms': h.quantile(0.95) * 1000,
+                        'p99_ms': h.quantile(0.99) * 1000,
+                        'max_ms': h.max * 1000,
+                        'rows': self._rows.get(name, 0)} for name, h in items]
+        return sorted(summary, key=lambda s: s['total_ms'], reverse=True)
+
+    def prometheus_text(self, gauges: dict = None) -> str:
+        """ All metrics in the Prometheus text exposition format.
+            gauges = optional extra {metric name: value} (pool and cache stats)
+        """
+        lines = []
+        with self._lock:
+            for kind, (metric, label, help_text) in _KINDS.items():
+                items = sorted((name, h) for (k, name), h in self._histograms.items() if k == kind)
+                if not items:
+                    continue
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for name, h in items:
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, h.counts):
+                        cumulative += n
+                        lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {h.count}')
+                    lines.append(f'{metric}_sum{{{label}="{name}"}} {h.sum:.6f}')
+                    lines.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+                errors_metric = metric.replace("_seconds", "_errors_total")
+                lines.append(f"# TYPE {errors_metric} counter")
+                for name, h in items:
+                    lines.append(f'{errors_metric}{{{label}="{name}"}} {h.errors}')
+            lines.append("# HELP fzdbot_db_rows_total Rows fetched by each fzd_db function")
+            lines.append("# TYPE fzdbot_db_rows_total counter")
+            for name, rows in sorted(self._rows.items()):
+                lines.append(f'fzdbot_db_rows_total{{function="{name}"}} {rows}')
+            lines.append("# HELP fzdbot_db_coalesced_total Calls answered by an identical query already in flight")
+            lines.append("# TYPE fzdbot_db_coalesced_total counter")
+            for name, count in sorted(self._coalesced.items()):
+                lines.append(f'fzdbot_db_coalesced_total{{function="{name}"}} {count}')
+            lines.append("# HELP fzdbot_command_deferred_total Responses deferred because the command ran past the response budget")
+            lines.append("# TYPE fzdbot_command_deferred_total counter")
+            for name, count in sorted(self._deferred.items()):
+                lines.append(f'fzdbot_command_deferred_total{{command="{name}"}} {count}')
+            lines.append("# HELP fzdbot_slow_queries_total Queries slower than SLOW_QUERY_MS")
+            lines.append("# TYPE fzdbot_slow_queries_total counter")
+            lines.append(f"fzdbot_slow_queries_total {self.slow_query_count}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, gauges: dict = None) -> None:
+        """ Writes prometheus_text() to path atomically (for node_exporter's textfile collector)
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text(gauges))
+        os.replace(tmp_path, path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._rows.clear()
+            self._coalesced.clear()
+            self._deferred.clear()
+            self.slow_queries.clear()
+            self.slow_query_count = 0
+            self.started = time.time()
+
+
+metrics = Metrics(slow_query_seconds=float(os.getenv("SLOW_QUERY_MS", 200)) / 1000)
+
+_current = threading.local() # Name of the fzd_db function running on this thread, rows/queries are counted for it
+current_command = contextvars.ContextVar('current_command', default="unknown") # Command handled by this task
+
+
+def instrumented(func):
+    """ Decorator for fzd_db functions: records latency, calls and errors under func's name
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_current, 'name', None)
+        _current.name = name
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            metrics.observe('db', name, time.perf_counter() - start, failed)
+            _current.name = outer
+    return wrapper
+
+def timed_command(func):
+    """ Decorator for slash command and autocomplete callbacks (coroutines),
+        put it right above the async def so discord.py still sees the signature
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_command.set(name)
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            metrics.observe('command', name, time.perf_counter() - start, failed)
+            current_command.reset(token)
+    return wrapper
+
+
+class _TimedCursor:
+    """ Cursor wrapper timing execute()/executemany() and counting fetched rows
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, sql, params):
+        name = getattr(_current, 'name', None) or "unknown"
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = method(sql, params)
+            failed = False
+            return result
+        finally:
+            metrics.observe_query(name, sql, time.perf_counter() - start, failed)
+
+    def execute(self, sql, params=()):
+        return self._timed(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self._timed(self._cursor.executemany, sql, seq_params)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            metrics.add_rows(getattr(_current, 'name', None) or "unknown", 1)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        metrics.add_rows(getattr(_current, 'name', None) or "unknown", len(rows))
+        return rows
+
+    def __iter__(self): # Streaming cursors, rows are counted as they come
+        name = getattr(_current, 'name', None) or "unknown"
+        rows = 0
+        try:
+            for row in self._cursor:
+                rows += 1
+                yield row
+        finally:
+            metrics.add_rows(name, rows)
+
+    def __getattr__(self, attr): # lastrowid, rowcount, close, ...
+        return getattr(self._cursor, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class _TimedConnection:
+    """ Connection wrapper whose cursors are _TimedCursors
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, attr): # commit, rollback, is_connected, ...
+        return getattr(self._conn, attr)
+
+
+def instrument_connection(conn):
+    if isinstance(conn, _TimedConnection): # Already instrumented (connection passed down to a nested call)
+        return conn
+    return _TimedConnection(conn)
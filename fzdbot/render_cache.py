@@ -0,0 +1,79 @@
+""" Cache of rendered /show scoreboards
+
+    Entries are keyed by (scheduled_event_id, score data version, display
+    options), where the version comes from caches.score_versions and changes
+    with every write to that event's scores. So a cached render is never
+    stale, and identical /show calls just re-send an embed that is already
+    built. Bounded both by number of entries and by (approximate) size,
+    least recently used entries go first
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """ LRU cache of {'fields': [str, ...], 'embed': discord.Embed} payloads
+        (/show pages also carry their 'rows', see render_scoreboard_page in bot.py)
+    """
+    def __init__(self, max_entries: int = 64, max_bytes: int = 2_000_000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # (scheduled_event_id, version, options) -> (payload, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(payload) -> int:
+        # The embed holds the same text as the fields, counted twice. The row dicts of a
+        # /show page (kept for its pager) weigh more than their text, so they are measured
+        rows = payload.get('rows', ())
+        return (sum(len(block) for block in payload['fields']) * 2 + 512
+                + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values()) for row in rows))
+
+    def get(self, scheduled_event_id, version, options):
+        key = (scheduled_event_id, version, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, scheduled_event_id, version, options, payload) -> None:
+        key = (scheduled_event_id, version, options)
+        size = self._size(payload)
+        with self._lock:
+            # Renders of older versions of the same event can never be hit again
+            for old_key in [k for k in self._entries if k[0] == scheduled_event_id and k[1] != version]:
+                self._bytes -= self._entries.pop(old_key)[1]
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (payload, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def invalidate(self, scheduled_event_id=None) -> None:
+        with self._lock:
+            if scheduled_event_id is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == scheduled_event_id]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+render_cache = RenderCache(max_entries=int(os.getenv("RENDER_CACHE_SIZE", 64)),
+                           max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", 2_000_000)))
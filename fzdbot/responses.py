@@ -0,0 +1,91 @@
+""" Interaction responses that survive slow database work
+
+    Discord wants every interaction acknowledged within 3 seconds, or the
+    user sees "This interaction failed" (even when their score was stored).
+    Handlers wrap the interaction in a DeferredResponse as soon as they
+    start and await their database work through run(): if the work hasn't
+    finished when RESPONSE_BUDGET seconds have passed since the handler
+    started, the interaction is deferred ("Bot is thinking...") and the work
+    keeps going. send() and edit() then deliver the reply the right way:
+    the initial response when there was no deferral, else by editing the
+    deferred response or as a followup. Fast commands still answer with a
+    single initial response, no extra API calls.
+
+    Deferrals are counted per command (metrics.deferred(), /bot_stats)
+"""
+import os
+import time
+import asyncio
+
+import discord
+
+from fzdbot.metrics import metrics
+from fzdbot.metrics import current_command
+
+# Seconds of the 3 second acknowledgement window the work may use before the interaction is deferred,
+# the rest is headroom for gateway latency and the defer request itself
+RESPONSE_BUDGET = float(os.getenv("RESPONSE_BUDGET", 2.0))
+
+
+class DeferredResponse:
+    """ Reply channel of one interaction. ephemeral = visibility of the reply (and of the
+        "thinking" message if the interaction gets deferred). Slash command interactions
+        are answered with a message (send), component interactions (buttons) usually
+        update the message they belong to (edit)
+    """
+    def __init__(self, interaction: discord.Interaction, ephemeral: bool = False, name: str = None):
+        self.interaction = interaction
+        self.ephemeral = ephemeral
+        self.name = name or current_command.get()
+        self.started = time.perf_counter()
+        self.deferred = False
+        self.replied = False # First message after a deferral replaces the "thinking" message
+
+    def remaining(self) -> float:
+        """ Seconds left before the interaction has to be acknowledged """
+        return RESPONSE_BUDGET - (time.perf_counter() - self.started)
+
+    async def defer(self) -> None:
+        if self.interaction.response.is_done():
+            return
+        updates_message = self.interaction.type is discord.InteractionType.component
+        await self.interaction.response.defer(ephemeral=self.ephemeral, thinking=not updates_message)
+        self.deferred = True
+        metrics.add_deferred(self.name)
+
+    async def run(self, awaitable):
+        """ Awaits the work (a coroutine) and returns its result. Defers the interaction
+            first if the work doesn't finish within the remaining budget
+        """
+        if self.interaction.response.is_done():
+            return await awaitable
+        task = asyncio.ensure_future(awaitable)
+        done, _ = await asyncio.wait({task}, timeout=max(0.0, self.remaining()))
+        if not done:
+            await self.defer()
+        return await task
+
+    async def send(self, content: str = None, *, ephemeral: bool = None, **kwargs) -> None:
+        """ Replies with a message (same keyword arguments as send_message: embed, view, ...)
+        """
+        ephemeral = self.ephemeral if ephemeral is None else ephemeral
+        response = self.interaction.response
+        if not response.is_done():
+            await response.send_message(content, ephemeral=ephemeral, **kwargs)
+        elif self.deferred and not self.replied and ephemeral == self.ephemeral and \
+                self.interaction.type is not discord.InteractionType.component:
+            await self.interaction.edit_original_response(content=content, **kwargs)
+        else:
+            await self.interaction.followup.send(content, ephemeral=ephemeral, **kwargs)
+            if self.deferred and not self.replied and self.interaction.type is not discord.InteractionType.component:
+                # The "thinking" message had the other visibility, the followup replaced it
+                await self.interaction.delete_original_response()
+        self.replied = True
+
+    async def edit(self, **kwargs) -> None:
+        """ Edits the message of a component interaction (content, embed, view, ...)
+        """
+        if not self.interaction.response.is_done():
+            await self.interaction.response.edit_message(**kwargs)
+        else:
+            await self.interaction.edit_original_response(**kwargs)
@@ -0,0 +1,251 @@
+""" Versioned schema of the FZD database
+
+    Every table fzd_db.py uses is defined here, and the schema is built up
+    by MIGRATIONS: numbered steps applied in order by fzd_db.migrate_schema()
+    when the bot starts. The version of each applied step is recorded in the
+    schema_migrations table, so a step runs once per database.
+    Steps are idempotent (tables, columns and indexes are only created when
+    missing), because databases from before the migrations already had some
+    of them and MySQL commits DDL right away, so a step interrupted half-way
+    runs again from the start.
+
+    DDL is written in MySQL dialect like the rest of fzd_db, sqlite_backend
+    translates it. The indexes are chosen for the queries in fzd_db (see the
+    comments in _covering_indexes), benchmarks/check_query_plans.py checks
+    that none of those queries falls back to a full table scan
+"""
+import sqlite3
+import mysql.connector
+
+# Table name -> CREATE TABLE statement (current definition, the migrations create them in this shape)
+TABLES = {
+    'schema_migrations': """CREATE TABLE schema_migrations (
+                                version INT NOT NULL PRIMARY KEY,
+                                description VARCHAR(255) NOT NULL,
+                                applied_at DATETIME NOT NULL
+                            );""",
+    'events': """CREATE TABLE events (
+                     id INT NOT NULL PRIMARY KEY,
+                     name VARCHAR(255) NOT NULL,
+                     recurring TINYINT NOT NULL DEFAULT 1
+                 );""",
+    'users': """CREATE TABLE users (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    tag VARCHAR(255),
+                    discord_display_name VARCHAR(255),
+                    discord_user_id VARCHAR(255) NOT NULL
+                );""",
+    'events_scheduled': """CREATE TABLE events_scheduled (
+                               id INT AUTO_INCREMENT PRIMARY KEY,
+                               event_id INT NOT NULL REFERENCES events(id),
+                               utc_start_dt DATETIME NOT NULL,
+                               utc_end_dt DATETIME NOT NULL
+                           );""",
+    'event_result_points': """CREATE TABLE event_result_points (
+                                  id INT AUTO_INCREMENT PRIMARY KEY,
+                                  scheduled_event_id INT NOT NULL REFERENCES events_scheduled(id),
+                                  user_id INT NOT NULL REFERENCES users(id),
+                                  score INT NOT NULL
+                              );""",
+    # Frozen standings of finished events, /show reads those directly
+    'event_standings': """CREATE TABLE event_standings (
+                              scheduled_event_id INT NOT NULL,
+                              player_rank INT NOT NULL,
+                              player VARCHAR(255) NOT NULL,
+                              score BIGINT NOT NULL,
+                              PRIMARY KEY (scheduled_event_id, player_rank, player)
+                          );""",
+    'event_snapshots': """CREATE TABLE event_snapshots (
+                              scheduled_event_id INT NOT NULL PRIMARY KEY,
+                              total_players INT NOT NULL,
+                              finalized_at DATETIME NOT NULL
+                          );""",
+    # Season standings and player stats, rolled up from finished events (see stats.py)
+    'player_stats': """CREATE TABLE player_stats (
+                           guild_id BIGINT NOT NULL,
+                           event_id INT NOT NULL,
+                           user_id INT NOT NULL,
+                           events_played INT NOT NULL,
+                           total_score BIGINT NOT NULL,
+                           best_score BIGINT NOT NULL,
+                           best_finish INT NOT NULL,
+                           wins INT NOT NULL,
+                           podiums INT NOT NULL,
+                           PRIMARY KEY (guild_id, event_id, user_id)
+                       );""",
+    'stats_events': """CREATE TABLE stats_events (
+                           scheduled_event_id INT NOT NULL PRIMARY KEY,
+                           guild_id BIGINT NOT NULL,
+                           event_id INT NOT NULL
+                       );""",
+    # Last write-behind journal entry inserted (see ingest.py)
+    'score_journal_checkpoint': """CREATE TABLE score_journal_checkpoint (
+                                       journal VARCHAR(255) NOT NULL PRIMARY KEY,
+                                       last_seq BIGINT NOT NULL
+                                   );""",
+}
+
+_DB_ERRORS = (mysql.connector.Error, sqlite3.Error)
+
+
+# ----- helpers, each one safe to run again -----
+
+def has_table(cursor, table) -> bool:
+    """ Whether table exists (portable between MySQL and SQLite: just try to read it) """
+    try:
+        cursor.execute(f"SELECT 1 FROM {table} LIMIT 1;")
+        cursor.fetchall()
+        return True
+    except _DB_ERRORS:
+        return False
+
+def has_column(cursor, table, column) -> bool:
+    try:
+        cursor.execute(f"SELECT {column} FROM {table} LIMIT 1;")
+        cursor.fetchall()
+        return True
+    except _DB_ERRORS:
+        return False
+
+def create_table(cursor, table) -> None:
+    """ Creates table as defined in TABLES if it doesn't exist (no IF NOT EXISTS: MySQL
+        warns about existing tables, and the connection raises on warnings)
+    """
+    if not has_table(cursor, table):
+        cursor.execute(TABLES[table])
+
+def _indexes(cursor, backend, table) -> dict:
+    """ index name -> (tuple of columns, unique) of the indexes of table """
+    indexes = {}
+    if backend == "sqlite":
+        cursor.execute(f"PRAGMA index_list({table});")
+        for _, name, unique, *_ in cursor.fetchall():
+            cursor.execute(f"PRAGMA index_info({name});")
+            columns = tuple(column for _, _, column in sorted(cursor.fetchall()))
+            indexes[name] = (columns, bool(unique))
+    else:
+        cursor.execute("""SELECT index_name, non_unique, column_name FROM information_schema.statistics
+                          WHERE table_schema = DATABASE() AND table_name = %s
+                          ORDER BY index_name, seq_in_index;""", [table])
+        for name, non_unique, column in cursor.fetchall():
+            columns, _ = indexes.get(name, ((), False))
+            indexes[name] = (columns + (column,), not non_unique)
+    return indexes
+
+def create_index(cursor, backend, table, name, columns, unique=False) -> None:
+    """ Creates an index unless one with that name, or with the same columns, exists already """
+    existing = _indexes(cursor, backend, table)
+    if name in existing or any(cols == tuple(columns) and (is_unique or not unique) for cols, is_unique in existing.values()):
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    cursor.execute(f"CREATE {kind} {name} ON {table} ({', '.join(columns)});")
+
+
+# ----- migrations, in order. Each one is called with (cursor, backend, default_guild_id) -----
+
+def _base_tables(cursor, backend, default_guild_id) -> None:
+    """ The tables of the original bot (existing databases already have them) """
+    for table in ('events', 'users', 'events_scheduled', 'event_result_points'):
+        create_table(cursor, table)
+
+def _merge_duplicate_users(cursor) -> None:
+    """ Registration used to check first and insert then, so two racing /add_score calls could
+        register the same discord user twice. Keeps the oldest row of each discord user (with the
+        first tag any of its rows has) and moves the scores of the others to it
+    """
+    cursor.execute("""SELECT discord_user_id FROM users
+                      GROUP BY discord_user_id HAVING COUNT(*) > 1;""")
+    duplicated = [row[0] for row in cursor.fetchall()]
+    merged = 0
+    for discord_user_id in duplicated:
+        cursor.execute("SELECT id, tag FROM users WHERE discord_user_id = %s ORDER BY id;", [discord_user_id])
+        rows = cursor.fetchall()
+        keep_id, keep_tag = rows[0]
+        extra_ids = [user_id for user_id, _ in rows[1:]]
+        placeholders = ", ".join(["%s"] * len(extra_ids))
+        cursor.execute(f"UPDATE event_result_points SET user_id = %s WHERE user_id IN ({placeholders});",
+                       [keep_id] + extra_ids)
+        cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders});", extra_ids)
+        tag = keep_tag or next((tag for _, tag in rows if tag), None)
+        if tag != keep_tag:
+            cursor.execute("UPDATE users SET tag = %s WHERE id = %s;", [tag, keep_id])
+        merged += len(extra_ids)
+    if not merged:
+        return
+    # Stats counted the duplicates as different players, update_player_stats recounts everything
+    if has_table(cursor, 'player_stats'):
+        cursor.execute("DELETE FROM player_stats;")
+    if has_table(cursor, 'stats_events'):
+        cursor.execute("DELETE FROM stats_events;")
+    print(f"Merged {merged} duplicate rows of {len(duplicated)} discord users into their oldest row, with their scores")
+
+def _unique_users(cursor, backend, default_guild_id) -> None:
+    # First-time /add_score registers users atomically with an upsert on this key
+    if 'uq_users_discord_user_id' not in _indexes(cursor, backend, 'users'):
+        _merge_duplicate_users(cursor)
+    create_index(cursor, backend, 'users', 'uq_users_discord_user_id', ('discord_user_id',), unique=True)
+
+def _guild_column(cursor, backend, default_guild_id) -> None:
+    """ Every scheduled event belongs to one guild, events from before belong to the first one """
+    if not has_column(cursor, 'events_scheduled', 'guild_id'):
+        cursor.execute(f"ALTER TABLE events_scheduled ADD COLUMN guild_id BIGINT NOT NULL DEFAULT {int(default_guild_id)};")
+        print(f"Added guild_id to events_scheduled, existing events belong to guild {default_guild_id}")
+
+def _snapshot_tables(cursor, backend, default_guild_id) -> None:
+    create_table(cursor, 'event_standings')
+    create_table(cursor, 'event_snapshots')
+
+def _stats_tables(cursor, backend, default_guild_id) -> None:
+    # Stats tables from before guilds existed are dropped, update_player_stats rebuilds them
+    if has_table(cursor, 'player_stats') and not has_column(cursor, 'player_stats', 'guild_id'):
+        cursor.execute("DROP TABLE player_stats;")
+        if has_table(cursor, 'stats_events'):
+            cursor.execute("DROP TABLE stats_events;")
+    create_table(cursor, 'player_stats')
+    create_table(cursor, 'stats_events')
+
+def _journal_table(cursor, backend, default_guild_id) -> None:
+    create_table(cursor, 'score_journal_checkpoint')
+
+def _covering_indexes(cursor, backend, default_guild_id) -> None:
+    """ One index per access path of the fzd_db queries, holding every column the query
+        reads from the table (the primary key is part of every index, both in InnoDB and
+        SQLite), so they are answered from the index alone
+    """
+    indexes = [
+        # get_event_types
+        ('events', 'idx_events_recurring', ('recurring', 'id', 'name')),
+        # import_scores looks players up by username or tag
+        ('users', 'idx_users_tag', ('tag',)),
+        # Latest / recent events of a guild (get_latest_event, get_recent_events), newest first
+        ('events_scheduled', 'idx_es_guild_start_cover', ('guild_id', 'utc_start_dt', 'event_id', 'utc_end_dt')),
+        # ... of one event type
+        ('events_scheduled', 'idx_es_guild_event_start_cover', ('guild_id', 'event_id', 'utc_start_dt', 'utc_end_dt')),
+        # Active / next event of a guild (_load_active_event)
+        ('events_scheduled', 'idx_es_guild_end_cover', ('guild_id', 'utc_end_dt', 'utc_start_dt', 'event_id')),
+        # Ended events of every guild (finalize_ended_events)
+        ('events_scheduled', 'idx_es_end_start', ('utc_end_dt', 'utc_start_dt')),
+        # Scores of an event (scoreboards, snapshots, stats, export) and of a user in an event (get_user_scores)
+        ('event_result_points', 'idx_erp_event_user_score', ('scheduled_event_id', 'user_id', 'score')),
+        # Best totals of an event type in a guild (get_standings)
+        ('player_stats', 'idx_ps_guild_event_total', ('guild_id', 'event_id', 'total_score')),
+        # Stats of one player (get_player_stats)
+        ('player_stats', 'idx_ps_user_guild', ('user_id', 'guild_id')),
+        # Events counted per guild and type (get_standings, get_player_stats, import_scores)
+        ('stats_events', 'idx_se_guild_event', ('guild_id', 'event_id')),
+    ]
+    for table, name, columns in indexes:
+        create_index(cursor, backend, table, name, columns)
+
+# (version, description, migration). Append new steps at the end, never change applied ones
+MIGRATIONS = [
+    (1, "base tables", _base_tables),
+    (2, "unique discord user ids", _unique_users),
+    (3, "scheduled events belong to a guild", _guild_column),
+    (4, "scoreboard snapshot tables", _snapshot_tables),
+    (5, "player statistics tables", _stats_tables),
+    (6, "write-behind journal checkpoint table", _journal_table),
+    (7, "covering indexes for the fzd_db queries", _covering_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
@@ -0,0 +1,172 @@
+""" Materialized scoreboards of the live (active) events
+
+    Built once from the get_event_scoreboard query, then kept up to date
+    incrementally by submit_score / edit_score / delete_score, so repeated
+    /show calls during a running event cost no database work. Players are
+    kept in a list sorted by (-score, player), so rank lookups are a bisect
+    and the top N is a slice. Each guild can have an event running, so one
+    board is kept per scheduled event (at most max_events, least recently
+    used dropped first)
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right, insort
+
+
+class _Board:
+    __slots__ = ('totals', 'counts', 'order')
+
+    def __init__(self, totals: dict, counts: dict):
+        self.totals = totals # player -> total score
+        self.counts = counts # player -> number of score rows
+        self.order = sorted((-score, player) for player, score in totals.items()) # [(-total, player), ...]
+
+
+class LiveScoreboard:
+    """ Per player totals of the running scheduled events, always sorted by score
+    """
+    def __init__(self, max_events: int = 16):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.version = 0    # Bumped on every change of the standings
+        self._changes = 0   # Counts writes/invalidations, used to detect races with a rebuild
+        self._inflight = 0  # Score writes started but not applied yet
+        self._boards = OrderedDict() # scheduled_event_id -> _Board
+
+    def _board(self, scheduled_event_id):
+        board = self._boards.get(scheduled_event_id)
+        if board is not None:
+            self._boards.move_to_end(scheduled_event_id)
+        return board
+
+    # ----- building -----
+
+    def begin_rebuild(self) -> int:
+        """ Call before running the scoreboard query, pass the result to finish_rebuild()
+        """
+        with self._lock:
+            return self._changes
+
+    def finish_rebuild(self, token: int, scheduled_event_id, rows) -> bool:
+        """ Installs the standings of scheduled_event_id from query rows
+            ([{'player': str, 'score': number, 'num_scores': int}, ...]). Refused (returns
+            False) if the scores changed while the query ran, the next read rebuilds again
+        """
+        with self._lock:
+            if token != self._changes or self._inflight:
+                return False
+            self._boards[scheduled_event_id] = _Board({row['player']: int(row['score']) for row in rows},
+                                                      {row['player']: int(row.get('num_scores', 1)) for row in rows})
+            self._boards.move_to_end(scheduled_event_id)
+            while len(self._boards) > self.max_events:
+                self._boards.popitem(last=False)
+            self.version += 1
+            return True
+
+    def invalidate(self, scheduled_event_id=None) -> None:
+        """ Drops the board of one event, or all of them """
+        with self._lock:
+            if scheduled_event_id is None:
+                self._boards.clear()
+            else:
+                self._boards.pop(scheduled_event_id, None)
+            self._changes += 1
+            self.version += 1
+
+    def events(self) -> list:
+        """ Scheduled event ids currently materialized """
+        with self._lock:
+            return list(self._boards)
+
+    # ----- incremental updates -----
+
+    @contextmanager
+    def change(self):
+        """ Wrap every score write (the query and the apply() after it) in this,
+            so a concurrent rebuild never installs standings that miss or double count it
+        """
+        with self._lock:
+            self._inflight += 1
+            self._changes += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def apply(self, scheduled_event_id, player, delta: int, rows_delta: int = 0) -> None:
+        """ Adds delta to player's total in scheduled_event_id.
+            rows_delta = +1 for a new score row, -1 for a deleted one, 0 for an edit.
+            player=None means the player isn't known, so the scoreboard is invalidated
+        """
+        with self._lock:
+            board = self._boards.get(scheduled_event_id)
+            if board is None:
+                return
+            if player is None:
+                del self._boards[scheduled_event_id]
+                self.version += 1
+                return
+
+            old_total = board.totals.get(player)
+            if old_total is not None:
+                del board.order[bisect_left(board.order, (-old_total, player))]
+            count = board.counts.get(player, 0) + rows_delta
+            if count <= 0: # No score rows left, player drops off the scoreboard (like in SQL)
+                board.totals.pop(player, None)
+                board.counts.pop(player, None)
+            else:
+                total = (old_total or 0) + delta
+                board.totals[player] = total
+                board.counts[player] = count
+                insort(board.order, (-total, player))
+            self.version += 1
+
+    # ----- reads -----
+
+    def rows(self, scheduled_event_id, limit: int = None):
+        """ Returns [{'player': str, 'score': int}, ...] sorted by score (like the
+            scoreboard query), or None if the scoreboard doesn't hold that event
+        """
+        with self._lock:
+            board = self._board(scheduled_event_id)
+            if board is None:
+                return None
+            order = board.order if limit is None else board.order[:limit]
+            return [{'player': player, 'score': -negscore} for negscore, player in order]
+
+    def page(self, scheduled_event_id, page_size: int, after=None, before=None):
+        """ Keyset page of the standings, like get_scoreboard_page(): the page_size
+            players right after the (score, player) key `after`, or right before `before`,
+            each with its competition rank. Returns (rows, total players) or None if
+            the scoreboard doesn't hold that event
+        """
+        with self._lock:
+            board = self._board(scheduled_event_id)
+            if board is None:
+                return None
+            order = board.order
+            if after is not None:
+                start = bisect_right(order, (-after[0], after[1]))
+            elif before is not None:
+                start = max(0, bisect_left(order, (-before[0], before[1])) - page_size)
+            else:
+                start = 0
+            rows = [{'rank': bisect_left(order, (negscore, '')) + 1, 'player': player, 'score': -negscore}
+                    for negscore, player in order[start:start + page_size]]
+            return rows, len(order)
+
+    def rank(self, scheduled_event_id, player):
+        """ Competition rank of player (ties share the best rank), None if not on the board
+        """
+        with self._lock:
+            board = self._boards.get(scheduled_event_id)
+            total = board.totals.get(player) if board is not None else None
+            if total is None:
+                return None
+            return bisect_left(board.order, (-total, '')) + 1
+
+
+live_scoreboard = LiveScoreboard(max_events=int(os.getenv("LIVE_SCOREBOARD_EVENTS", 16)))
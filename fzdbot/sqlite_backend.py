@@ -0,0 +1,185 @@
+""" Embedded SQLite backend for fzd_db (DB_BACKEND=sqlite)
+
+    fzd_db.py talks to its database through the small part of the
+    mysql.connector API it needs: conn.cursor(dictionary=True), execute,
+    executemany, fetchone/fetchall, lastrowid, rowcount, commit, rollback,
+    ping and is_connected. SQLiteConnection provides the same surface on top
+    of the sqlite3 module, so every fzd_db function (and the connection pool)
+    works unchanged. The SQL in fzd_db stays in MySQL dialect; the few
+    MySQL-only constructs it uses are rewritten once per statement text
+    (the schema migrations in schema.py included).
+
+    The database file runs in WAL mode (readers never block the writer) with
+    pragmas tuned for a small, local, read-mostly database
+"""
+import re
+import sqlite3
+import functools
+from datetime import datetime
+
+TFORMAT = '%Y-%m-%d %H:%M:%S'
+# Upserts without a conflict target and RETURNING (see _TRANSLATIONS) need SQLite 3.35
+MIN_SQLITE_VERSION = (3, 35, 0)
+_DATETIME_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+# MySQL construct -> SQLite equivalent (applied in order)
+_TRANSLATIONS = [
+    (re.compile(r"UTC_TIMESTAMP\(\)\s*-\s*INTERVAL\s+%s\s+MINUTE"), "datetime('now', '-' || %s || ' minutes')"),
+    (re.compile(r"UTC_TIMESTAMP\(\)"), "datetime('now')"),
+    (re.compile(r"\bAS\s+CHAR\)"), "AS TEXT)"),
+    (re.compile(r"\bINT\s+AUTO_INCREMENT\s+PRIMARY KEY"), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    # MySQL idiom to get the id of the existing row in lastrowid (last in the update list), see SQLiteCursor.execute
+    (re.compile(r"\b(\w+)\s*=\s*LAST_INSERT_ID\(\1\)\s*;?\s*$"), r"\1 = \1 RETURNING \1"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE"), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"VALUES\((\w+)\)"), r"excluded.\1"),
+    # SQLite compares text by code point already (BINARY collation)
+    (re.compile(r"CONVERT\((.+?) USING utf8mb4\) COLLATE utf8mb4_bin"), r"\1 COLLATE BINARY"),
+    (re.compile(r"%s"), "?"),
+]
+
+# Applied to every connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, only the last commits can be lost on power failure
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",   # 16 MB page cache per connection
+    "PRAGMA mmap_size=268435456", # Read through a 256 MB memory map
+)
+
+
+@functools.lru_cache(maxsize=256)
+def translate(sql: str) -> str:
+    """ Rewrites one MySQL statement of fzd_db to SQLite (cached per statement text) """
+    for pattern, replacement in _TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+def _convert(value):
+    # DATETIME columns and datetime('now') come back as text, fzd_db expects datetimes
+    if isinstance(value, str) and len(value) == 19 and _DATETIME_RE.match(value):
+        return datetime.strptime(value, TFORMAT)
+    return value
+
+
+class SQLiteCursor:
+    def __init__(self, raw_cursor, dictionary: bool):
+        self._cursor = raw_cursor
+        self._dictionary = dictionary
+        self._lastrowid = None
+
+    def execute(self, sql, params=()):
+        statement = translate(sql)
+        self._cursor.execute(statement, tuple(params or ()))
+        if " RETURNING " in statement: # Upsert: lastrowid is the new or the existing row, like LAST_INSERT_ID(id)
+            row = self._cursor.fetchone()
+            self._cursor.fetchall()
+            self._lastrowid = row[0] if row else None
+        else:
+            self._lastrowid = None
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(translate(sql), [tuple(p) for p in seq_params])
+
+    def _row(self, row):
+        values = [_convert(v) for v in row]
+        if self._dictionary:
+            return dict(zip([d[0] for d in self._cursor.description], values))
+        return tuple(values)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    @property
+    def lastrowid(self):
+        return self._lastrowid if self._lastrowid is not None else self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """ sqlite3 connection with the mysql.connector methods fzd_db.py and db_pool.py use
+    """
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        # Pooled connections move between executor threads, but only one uses it at a time
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False,
+                                     cached_statements=256)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, *args, **kwargs):
+        self._conn.execute("SELECT 1")
+
+    def is_connected(self):
+        try:
+            self._conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        self._conn.close()
+
+
+sqlite3.register_adapter(datetime, lambda dt: dt.strftime(TFORMAT))
+
+
+def check_version() -> None:
+    """ Raises sqlite3.NotSupportedError if the SQLite library Python was built with is too old
+        (e.g. Debian 11 ships 3.34, Ubuntu 20.04 3.31)
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = ".".join(map(str, MIN_SQLITE_VERSION))
+        raise sqlite3.NotSupportedError(f"DB_BACKEND=sqlite needs SQLite {required} or newer, this Python uses "
+                                        f"{sqlite3.sqlite_version}. Use a newer Python/OS build or DB_BACKEND=mysql")
+
+def connect(path: str, busy_timeout: float = 5.0) -> SQLiteConnection:
+    check_version()
+    return SQLiteConnection(path, busy_timeout)
+
+def create_database(path: str) -> None:
+    """ Creates the database file at path if it's missing and switches it to WAL mode.
+        The tables are created by the schema migrations (fzd_db.migrate_schema)
+    """
+    check_version()
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL") # Persistent, set once for the file
+    finally:
+        conn.close()
@@ -0,0 +1,93 @@
+""" Player statistics rollups, computed with NumPy
+
+    Season standings and /player_stats are served from player_stats rows,
+    one per (event type, player) with these columns (ROLLUP_COLUMNS):
+    events played, total of their event scores, best event score, best
+    finish (rank), wins and podiums. Averages and participation rates are
+    derived from them when displayed.
+
+    rollup() turns raw score rows of finished events into such rows,
+    merge() adds rollups together, so stats are updated incrementally from
+    just the newly finished events, and the initial backfill runs the same
+    code on batches of past events. Everything is vectorized: sorting once
+    and reducing over runs of equal keys, no Python loop per score or player
+"""
+import numpy as np
+
+ROLLUP_COLUMNS = ('event_id', 'user_id', 'events_played', 'total_score',
+                  'best_score', 'best_finish', 'wins', 'podiums')
+
+
+def _changes(*keys) -> np.ndarray:
+    """ Mask of the positions where a run of equal keys starts (arrays sorted by keys) """
+    mask = np.zeros(len(keys[0]), dtype=bool)
+    if len(mask):
+        mask[0] = True
+        for key in keys:
+            mask[1:] |= key[1:] != key[:-1]
+    return mask
+
+def empty() -> np.ndarray:
+    return np.empty((0, len(ROLLUP_COLUMNS)), dtype=np.int64)
+
+def rollup(results) -> np.ndarray:
+    """ results = [(scheduled_event_id, event_id, user_id, score), ...] (raw score rows)
+        Returns the rollup rows (ROLLUP_COLUMNS) of those events, as an int64 array
+    """
+    data = np.asarray(results, dtype=np.int64).reshape(-1, 4)
+    if not len(data):
+        return empty()
+    sched, etype, user, score = data.T
+
+    # Total of each player in each event
+    order = np.lexsort((user, sched))
+    sched, etype, user, score = sched[order], etype[order], user[order], score[order]
+    starts = np.flatnonzero(_changes(sched, user))
+    totals = np.add.reduceat(score, starts)
+    sched, etype, user = sched[starts], etype[starts], user[starts]
+
+    # Competition rank within each event (ties share the best rank, like the scoreboard)
+    order = np.lexsort((-totals, sched))
+    sched, etype, user, totals = sched[order], etype[order], user[order], totals[order]
+    position = np.arange(len(sched))
+    event_start = np.maximum.accumulate(np.where(_changes(sched), position, 0))
+    tie_start = np.maximum.accumulate(np.where(_changes(sched, totals), position, 0))
+    rank = tie_start - event_start + 1
+
+    # Per player and event type
+    order = np.lexsort((user, etype))
+    etype, user, totals, rank = etype[order], user[order], totals[order], rank[order]
+    starts = np.flatnonzero(_changes(etype, user))
+    return np.column_stack([
+        etype[starts],
+        user[starts],
+        np.diff(np.append(starts, len(etype))),          # events_played
+        np.add.reduceat(totals, starts),                 # total_score
+        np.maximum.reduceat(totals, starts),             # best_score
+        np.minimum.reduceat(rank, starts),               # best_finish
+        np.add.reduceat((rank == 1).astype(np.int64), starts), # wins
+        np.add.reduceat((rank <= 3).astype(np.int64), starts), # podiums
+    ]).astype(np.int64)
+
+def merge(*rollups) -> np.ndarray:
+    """ Combines rollup arrays (e.g. stored stats + newly finished events) into one
+    """
+    data = np.concatenate([np.asarray(r, dtype=np.int64).reshape(-1, len(ROLLUP_COLUMNS)) for r in rollups] or [empty()])
+    if not len(data):
+        return empty()
+    data = data[np.lexsort((data[:, 1], data[:, 0]))]
+    starts = np.flatnonzero(_changes(data[:, 0], data[:, 1]))
+    return np.column_stack([
+        data[starts, 0],
+        data[starts, 1],
+        np.add.reduceat(data[:, 2], starts),
+        np.add.reduceat(data[:, 3], starts),
+        np.maximum.reduceat(data[:, 4], starts),
+        np.minimum.reduceat(data[:, 5], starts),
+        np.add.reduceat(data[:, 6], starts),
+        np.add.reduceat(data[:, 7], starts),
+    ])
+
+def to_rows(rollup_array) -> list[tuple]:
+    """ Plain Python int tuples, ready for executemany() """
+    return [tuple(row) for row in np.asarray(rollup_array).tolist()]